@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+词云图生成器性能基准测试
+覆盖所有内置形状、不同画布尺寸和词汇数量、自定义图片掩码、图片取色以及完整的 /generate 请求，
+记录各阶段耗时（中位数）和内存峰值，结果保存为JSON，可与其他提交的结果对比
+
+用法:
+  python benchmark.py                          - 运行全部基准测试并输出到 benchmark_results.json
+  python benchmark.py --quick                  - 快速模式（更少的尺寸和重复次数）
+  python benchmark.py --out new.json --compare old.json - 运行并与旧结果对比
+  python benchmark.py --diff old.json new.json - 只对比两份已有结果
+  python benchmark.py --engine fast --compare benchmark_results.json - 使用加速布局引擎运行并与默认引擎对比
+"""
+
+import argparse
+import base64
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import wordcloud_app
+
+SIZES = [(400, 400), (800, 600), (1600, 1200)]
+QUICK_SIZES = [(400, 400)]
+WORD_COUNTS = [10, 100, 1000, 10000]
+QUICK_WORD_COUNTS = [10, 1000]
+DEFAULT_WORDS = 100
+REPEATS = 3
+QUICK_REPEATS = 1
+
+# 对比时耗时变化超过该比例才标记为回归/提升
+CHANGE_THRESHOLD = 0.10
+
+def make_text(n_words):
+    """生成 n_words 个不重复词汇组成的逗号分隔文本"""
+    return ','.join(f'词{i}' if i % 2 else f'word{i}' for i in range(n_words))
+
+def make_document(megabytes):
+    """生成约 megabytes MB 的中英文混合文档，词频服从长尾分布"""
+    import random
+    rng = random.Random(0)
+    vocabulary = [f'term{chr(97 + i % 26)}{chr(97 + i // 26 % 26)}{chr(97 + i // 676 % 26)}' for i in range(20000)]
+    vocabulary += ['数据分析', '可视化', '机器学习', '词云', '性能优化']
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    words = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        sentence = ' '.join(rng.choices(vocabulary, weights, k=20)) + '。\n'
+        words.append(sentence)
+        size += len(sentence)
+    return ''.join(words)
+
+def make_custom_image(width=600, height=600):
+    """生成一张带彩色圆形前景的测试图片，返回 base64 data URL"""
+    from PIL import Image, ImageDraw
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((width // 8, height // 8, width * 7 // 8, height * 7 // 8), fill=(200, 40, 40))
+    draw.rectangle((width // 3, height // 3, width * 2 // 3, height * 2 // 3), fill=(40, 80, 200))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+def reset_caches():
+    """清空进程内缓存，使每次测量都是冷路径"""
+    wordcloud_app.mask_cache.clear()
+    wordcloud_app.palette_cache.clear()
+
+def measure(func, repeats, warm=False):
+    """重复执行 func(timings)，返回各阶段耗时中位数（毫秒）和内存峰值（MB）"""
+    runs = []
+    for _ in range(repeats):
+        if not warm:
+            reset_caches()
+        gc.collect()
+        timings = {}
+        start = time.perf_counter()
+        func(timings)
+        timings['total'] = time.perf_counter() - start
+        runs.append(timings)
+
+    stages = {}
+    for name in runs[-1]:
+        stages[name] = round(statistics.median(run.get(name, 0.0) for run in runs) * 1000, 3)
+
+    # 单独执行一次统计内存峰值，避免 tracemalloc 的开销影响计时
+    if not warm:
+        reset_caches()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func({})
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'stages_ms': stages, 'peak_mb': round(peak / (1024 * 1024), 2), 'repeats': repeats}
+
+def render_case(**overrides):
+    """构造一个直接调用 render_from_params 的测试用例"""
+    data = {'text': make_text(DEFAULT_WORDS), 'shape': 'circle', 'width': 800, 'height': 600}
+    data.update(overrides)
+    params, error = wordcloud_app.parse_render_params(data)
+    if error:
+        raise ValueError(error)
+    return lambda timings: wordcloud_app.render_from_params(params, timings)
+
+def generate_case(client, **overrides):
+    """构造一个经过 Flask 测试客户端完整请求 /generate 的测试用例"""
+    data = {'text': make_text(DEFAULT_WORDS), 'shape': 'circle', 'width': 800, 'height': 600,
+            'cache': False, 'format': 'binary'}
+    data.update(overrides)
+
+    def run(timings):
+        response = client.post('/generate', json=data)
+        if response.status_code != 200:
+            raise RuntimeError(f'/generate 返回 {response.status_code}: {response.get_data(as_text=True)[:200]}')
+        # 各阶段耗时从 Server-Timing 响应头中读取
+        for entry in response.headers.get('Server-Timing', '').split(','):
+            name, _, duration = entry.strip().partition(';dur=')
+            if duration:
+                timings[name] = float(duration) / 1000
+    return run
+
+def iter_cases(quick=False, engine=None):
+    """依次产生 (用例名称, 用例函数)，engine 为所有用例使用的布局引擎（None 表示默认引擎）"""
+    sizes = QUICK_SIZES if quick else SIZES
+    word_counts = QUICK_WORD_COUNTS if quick else WORD_COUNTS
+    engine_options = {'layout_engine': engine} if engine else {}
+    client = wordcloud_app.app.test_client()
+
+    def render(**overrides):
+        return render_case(**engine_options, **overrides)
+
+    def generate(**overrides):
+        return generate_case(client, **engine_options, **overrides)
+
+    # 所有内置形状 × 画布尺寸
+    for shape in wordcloud_app.SHAPE_TEMPLATES:
+        if shape == 'custom':
+            continue
+        for width, height in sizes:
+            yield f'shape/{shape}/{width}x{height}', render(shape=shape, width=width, height=height)
+
+    # 词汇数量
+    for n_words in word_counts:
+        yield f'words/{n_words}', render(
+            text=make_text(n_words), max_words=min(n_words, wordcloud_app.MAX_WORDS_LIMIT))
+
+    # 文档模式（统计词频）
+    document = make_document(1 if quick else 8)
+    yield f'document/{len(document) // (1024 * 1024)}MB', render(text=document, input_mode='document')
+
+    # 自定义图片掩码，是否使用图片颜色
+    image_data = make_custom_image()
+    for width, height in sizes:
+        yield f'custom/{width}x{height}', render(
+            shape='custom', image_data=image_data, width=width, height=height)
+        yield f'custom_colors/{width}x{height}', render(
+            shape='custom', image_data=image_data, use_image_colors=True, width=width, height=height)
+
+    # 输出格式
+    for output_format in wordcloud_app.OUTPUT_FORMATS:
+        yield f'format/{output_format}', render(output_format=output_format)
+
+    # 完整的 /generate 请求（不使用缓存）
+    yield 'generate/circle', generate()
+    yield 'generate/frequencies', generate(
+        text='', frequencies={f'word{i}': DEFAULT_WORDS - i for i in range(DEFAULT_WORDS)})
+    yield 'generate/json', generate(format='json')
+    yield 'generate/china_map', generate(shape='china_map')
+    yield 'generate/custom_colors', generate(
+        shape='custom', image_data=image_data, use_image_colors=True)
+
+def git_commit():
+    """当前代码的 git 提交号（不是 git 仓库时返回 None）"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(quick=False, repeats=None, warm=False, pattern=None, engine=None):
+    """运行基准测试，返回结果字典"""
+    repeats = repeats or (QUICK_REPEATS if quick else REPEATS)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': quick,
+            'warm': warm,
+            'layout_engine': engine or wordcloud_app.DEFAULT_LAYOUT_ENGINE,
+            'repeats': repeats
+        },
+        'cases': {}
+    }
+
+    # 预先加载依赖和字体，避免把导入耗时算进第一个用例
+    wordcloud_app.load_wordcloud_class()
+    wordcloud_app.font_registry.scan()
+
+    for name, func in iter_cases(quick, engine):
+        if pattern and pattern not in name:
+            continue
+        # 先执行一次预热（导入、字体加载等一次性开销）
+        func({})
+        result = measure(func, repeats, warm)
+        results['cases'][name] = result
+        stages = ', '.join(f'{stage} {value:.1f}' for stage, value in result['stages_ms'].items()
+                           if stage != 'total')
+        print(f"  {name:<36} {result['stages_ms']['total']:>9.1f} ms  "
+              f"{result['peak_mb']:>7.1f} MB  ({stages})", flush=True)
+    return results
+
+def compare_results(old, new, threshold=CHANGE_THRESHOLD):
+    """对比两份结果的总耗时和内存峰值，打印变化并返回回归的用例数"""
+    def describe(results):
+        meta = results['meta']
+        return f"{meta.get('commit')} [{meta.get('layout_engine', 'wordcloud')}]"
+    print(f"📊 对比 {describe(old)} -> {describe(new)}")
+    regressions = 0
+    for name, result in new['cases'].items():
+        before = old['cases'].get(name)
+        if before is None:
+            print(f"  {name:<36} （新增）")
+            continue
+        old_ms, new_ms = before['stages_ms']['total'], result['stages_ms']['total']
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        mark = ''
+        if change > threshold:
+            mark = '⚠️  回归'
+            regressions += 1
+        elif change < -threshold:
+            mark = '✅ 提升'
+        print(f"  {name:<36} {old_ms:>9.1f} -> {new_ms:>9.1f} ms ({change:+.0%})  "
+              f"{before['peak_mb']:>7.1f} -> {result['peak_mb']:>7.1f} MB  {mark}")
+    for name in old['cases']:
+        if name not in new['cases']:
+            print(f"  {name:<36} （已移除）")
+    return regressions
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='词云图生成器性能基准测试')
+    parser.add_argument('--out', default='benchmark_results.json', help='结果输出文件（默认 benchmark_results.json）')
+    parser.add_argument('--quick', action='store_true', help='快速模式：更少的尺寸、词汇数量和重复次数')
+    parser.add_argument('--repeats', type=int, help='每个用例的重复次数')
+    parser.add_argument('--warm', action='store_true', help='保留掩码和调色板缓存（默认每次测量前清空）')
+    parser.add_argument('--filter', help='只运行名称包含该字符串的用例')
+    parser.add_argument('--engine', choices=sorted(wordcloud_app.LAYOUT_ENGINES),
+                        help=f'布局引擎（默认 {wordcloud_app.DEFAULT_LAYOUT_ENGINE}）')
+    parser.add_argument('--compare', help='与指定的旧结果文件对比')
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'), help='只对比两份已有结果，不运行测试')
+    args = parser.parse_args(argv)
+
+    if args.diff:
+        return 1 if compare_results(load_results(args.diff[0]), load_results(args.diff[1])) else 0
+
+    print("⏱️  运行基准测试（各阶段耗时为中位数，单位毫秒）")
+    results = run_benchmarks(args.quick, args.repeats, args.warm, args.filter, args.engine)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存到 {args.out}")
+
+    if args.compare:
+        return 1 if compare_results(load_results(args.compare), results) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""测试公共配置：渲染缓存的磁盘缓存写到临时目录，不写入仓库的 output 目录"""
+
+import pytest
+
+import wordcloud_app
+
+
+@pytest.fixture(autouse=True)
+def render_cache(tmp_path, monkeypatch):
+    cache = wordcloud_app.RenderCache(disk_dir=str(tmp_path / 'render_cache'))
+    monkeypatch.setattr(wordcloud_app, 'render_cache', cache)
+    return cache
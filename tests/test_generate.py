@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""/generate 和 /recolor 的参数校验测试"""
+
+import pytest
+
+import wordcloud_app
+
+
+@pytest.fixture
+def client():
+    wordcloud_app.configure_render_pool(0)
+    return wordcloud_app.app.test_client()
+
+
+def generate(client, **overrides):
+    data = {'text': 'alpha,beta,gamma,delta', 'shape': 'circle', 'width': 120, 'height': 120,
+            'cache': False, 'format': 'binary'}
+    data.update(overrides)
+    return client.post('/generate', json=data)
+
+
+@pytest.mark.parametrize('color_theme', sorted(wordcloud_app.COLOR_THEMES))
+def test_every_color_theme_renders(client, color_theme):
+    response = generate(client, color_theme=color_theme)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('color_theme', ['no-such-theme', 42, ['viridis']])
+def test_unknown_color_theme_is_rejected(client, color_theme):
+    response = generate(client, color_theme=color_theme)
+    assert response.status_code == 400
+
+
+def test_recolor_with_custom_theme(client):
+    response = generate(client, format='json')
+    layout_id = response.get_json()['layout_id']
+    response = client.post('/recolor', json={'layout_id': layout_id, 'color_theme': 'sunset', 'format': 'binary'})
+    assert response.status_code == 200
+    response = client.post('/recolor', json={'layout_id': layout_id, 'color_theme': 'nope'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('defaults', [['shape', 'circle'], 'circle', 3])
+def test_batch_rejects_non_object_defaults(client, defaults):
+    response = client.post('/generate/batch', json={'items': [{'text': 'a,b'}], 'defaults': defaults})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('options', [{'quality': 'high', 'output_format': 'webp'},
+                                     {'compress_level': 'max'},
+                                     {'quality': [80], 'output_format': 'jpeg'},
+                                     {'renderer': 'matplotlib', 'output_format': 'webp'}])
+def test_invalid_encode_options_are_rejected(client, options):
+    assert generate(client, **options).status_code == 400
+
+
+def test_numeric_string_quality_is_accepted(client):
+    response = generate(client, quality='80', output_format='jpeg')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+
+
+@pytest.mark.parametrize('priority', ['urgent', [1], {'level': 1}])
+def test_job_rejects_non_integer_priority(client, priority):
+    response = client.post('/jobs', json={'text': 'a,b,c', 'priority': priority})
+    assert response.status_code == 400
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""加速布局引擎与默认引擎的对比测试"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import wordcloud_app
+
+TEXT = ','.join(f'词{i}' if i % 2 else f'word{i}' for i in range(300))
+SEEDS = range(6)
+
+
+def layout(engine, seed, **overrides):
+    options = {'shape': 'circle', 'width': 500, 'height': 400, 'max_words': 300,
+               'layout_engine': engine, 'seed': seed}
+    options.update(overrides)
+    return wordcloud_app.create_wordcloud(TEXT, **options)
+
+
+def word_pixels(wordcloud, word, font_size, position, orientation):
+    """单独绘制一个词语，返回它占用的像素"""
+    img = Image.new('L', (wordcloud.width, wordcloud.height))
+    font = ImageFont.TransposedFont(ImageFont.truetype(wordcloud.font_path, font_size), orientation=orientation)
+    ImageDraw.Draw(img).text((position[1], position[0]), word, fill='white', font=font)
+    return np.asarray(img) > 0
+
+
+def test_fast_layout_places_as_many_words_as_default():
+    default = [len(layout('wordcloud', seed).layout_) for seed in SEEDS]
+    fast = [len(layout('fast', seed).layout_) for seed in SEEDS]
+    assert sum(fast) >= 0.95 * sum(default)
+
+
+@pytest.mark.parametrize('overrides', [{}, {'relative_scaling': 0}])
+def test_fast_layout_matches_default_format(overrides):
+    """layout_ 和 words_ 的格式与默认引擎相同，可以直接用 WordCloud 绘制和重新着色"""
+    default = layout('wordcloud', 1, **overrides)
+    fast = layout('fast', 1, **overrides)
+    assert fast.words_ == default.words_
+    for expected, actual in zip(default.layout_, fast.layout_):
+        (word, freq), font_size, position, orientation, color = actual
+        assert type(word) is type(expected[0][0]) and isinstance(freq, float)
+        assert type(font_size) is type(expected[1])
+        assert len(position) == 2 and all(isinstance(value, (int, np.integer)) for value in position)
+        assert orientation in (None, Image.ROTATE_90)
+        assert type(color) is type(expected[4])
+    assert fast.to_image().size == default.to_image().size
+    fast.recolor(random_state=1)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_fast_layout_has_no_overlap(seed):
+    """每个词语的像素都不与之前放置的词语重叠，也不落在掩码遮挡的区域"""
+    wordcloud = layout('fast', seed)
+    occupied = wordcloud.mask == 255
+    if occupied.ndim == 3:
+        occupied = occupied.all(axis=2)
+    for (word, _), font_size, position, orientation, _ in wordcloud.layout_:
+        pixels = word_pixels(wordcloud, word, font_size, position, orientation)
+        assert not (pixels & occupied).any(), word
+        occupied |= pixels
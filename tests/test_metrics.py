@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""/metrics 指标测试"""
+
+import wordcloud_app
+
+
+def test_unknown_shapes_share_one_label():
+    wordcloud_app.configure_render_pool(0)
+    client = wordcloud_app.app.test_client()
+    for shape in ('blob-1', 'blob-2'):
+        response = client.post('/generate', json={'text': 'a,b,c', 'shape': shape, 'width': 100, 'height': 100,
+                                                   'cache': False, 'format': 'binary'})
+        assert response.status_code == 200
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'shape="other"' in metrics
+    assert 'blob-' not in metrics
+    assert wordcloud_app.shape_label('circle') == 'circle'
+    assert wordcloud_app.shape_label(wordcloud_app.TEMPLATE_ID_PREFIX + 'abc') == 'template'
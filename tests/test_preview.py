@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""快速预览模式测试"""
+
+import json
+
+import pytest
+
+import wordcloud_app
+
+
+@pytest.fixture
+def client():
+    wordcloud_app.configure_render_pool(0)
+    return wordcloud_app.app.test_client()
+
+
+def preview_lines(client, width, height):
+    response = client.post('/generate', json={'text': 'alpha,beta,gamma', 'width': width, 'height': height,
+                                              'preview': True, 'cache': False})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_small_canvas_reuses_preview_as_final(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('预览已是完整尺寸时不应重新绘制')
+    monkeypatch.setattr(wordcloud_app, 'render_layout', fail)
+
+    side = wordcloud_app.PREVIEW_MAX_SIDE
+    preview, final = preview_lines(client, side, side // 2)
+    assert preview['stage'] == 'preview' and final['stage'] == 'final'
+    assert final['image'] == preview['image']
+
+
+def test_large_canvas_renders_final_at_full_size(client):
+    side = wordcloud_app.PREVIEW_MAX_SIDE * 2
+    preview, final = preview_lines(client, side, side)
+    assert final['stage'] == 'final'
+    assert final['image'] != preview['image']
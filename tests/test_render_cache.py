@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""渲染缓存测试：缓存键、ETag/304 和磁盘缓存淘汰"""
+
+import os
+import time
+
+import pytest
+
+import wordcloud_app
+
+REQUEST = {'text': 'alpha,beta,gamma', 'width': 150, 'height': 150, 'format': 'binary'}
+
+
+@pytest.fixture
+def client():
+    wordcloud_app.configure_render_pool(0)
+    return wordcloud_app.app.test_client()
+
+
+def params(**overrides):
+    data = dict(REQUEST, **overrides)
+    parsed, error = wordcloud_app.parse_render_params(data)
+    assert error is None
+    return parsed
+
+
+def test_cache_key_ignores_order_and_digests_image_data():
+    key = wordcloud_app.render_cache_key(params())
+    assert wordcloud_app.render_cache_key(dict(reversed(list(params().items())))) == key
+    assert wordcloud_app.render_cache_key(params(color_theme='plasma')) != key
+    
+    with_image = params(shape='custom', image_data='data:image/png;base64,AAAA')
+    other_image = params(shape='custom', image_data='data:image/png;base64,BBBB')
+    assert wordcloud_app.render_cache_key(with_image) != wordcloud_app.render_cache_key(other_image)
+    assert len(wordcloud_app.render_cache_key(with_image)) == 64
+
+
+def test_generate_hits_cache_and_honours_if_none_match(client, render_cache):
+    first = client.post('/generate', json=REQUEST)
+    assert first.status_code == 200 and first.headers['X-Cache'] == 'MISS'
+    etag = first.headers['ETag'].strip('"')
+    
+    second = client.post('/generate', json=REQUEST)
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.data == first.data
+    
+    not_modified = client.post('/generate', json=REQUEST, headers={'If-None-Match': f'"{etag}"'})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+    assert client.get(f'/result/{etag}', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+    assert render_cache.stats()['disk_entries'] == 1
+
+
+def test_disk_tier_survives_restart_and_evicts_oldest(tmp_path):
+    disk_dir = str(tmp_path / 'cache')
+    cache = wordcloud_app.RenderCache(disk_dir=disk_dir, disk_max_bytes=2500)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, bytes(1000), 'image/png', key)
+        # 依次设置较早的修改时间，确定淘汰顺序
+        os.utime(os.path.join(disk_dir, f'{key}.png'), (time.time() - 100 + i,) * 2)
+    assert sorted(os.listdir(disk_dir)) == ['b.png', 'c.png']
+    
+    restarted = wordcloud_app.RenderCache(disk_dir=disk_dir)
+    assert restarted.get('a') is None
+    image_bytes, mime_type, _ = restarted.get('c')
+    assert (image_bytes, mime_type) == (bytes(1000), 'image/png')
+    stats = restarted.stats()
+    assert (stats['disk_hits'], stats['misses'], stats['disk_entries']) == (1, 1, 2)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""渲染进程池测试：超时处理和 fork 启动"""
+
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+import wordcloud_app
+
+
+def sleep_ignoring_alarm(seconds):
+    """屏蔽 SIGALRM 后休眠，模拟无法在进程内中断的任务"""
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+    time.sleep(seconds)
+
+
+@pytest.fixture
+def pool():
+    pool = wordcloud_app.RenderPool(workers=1, queue_depth=2, timeout=1)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def wait_until_idle(pool, limit):
+    deadline = time.time() + limit
+    while pool.stats()['in_flight'] and time.time() < deadline:
+        time.sleep(0.05)
+    return pool.stats()['in_flight'] == 0
+
+
+@pytest.mark.skipif(not hasattr(signal, 'setitimer'), reason='需要 SIGALRM')
+def test_timed_out_job_is_interrupted_in_worker(pool):
+    worker_pid = pool.run(os.getpid)
+    with pytest.raises(wordcloud_app.RenderTimeout):
+        pool.run(time.sleep, 30)
+    # 任务在工作进程中被中断，同一个工作进程立即可以执行下一个任务
+    assert wait_until_idle(pool, 2)
+    assert pool.run(os.getpid) == worker_pid
+
+
+@pytest.mark.skipif(not hasattr(signal, 'pthread_sigmask'), reason='需要 pthread_sigmask')
+def test_stuck_job_recycles_the_pool(pool, monkeypatch):
+    monkeypatch.setattr(wordcloud_app, 'RENDER_KILL_GRACE', 0.5)
+    worker_pid = pool.run(os.getpid)
+    with pytest.raises(wordcloud_app.RenderTimeout):
+        pool.run(sleep_ignoring_alarm, 30)
+    assert wait_until_idle(pool, 5)
+    # 进程池已重建，第一个任务包括启动新工作进程的耗时
+    assert pool.run(os.getpid, timeout=60) != worker_pid
+
+
+def map_template_loads():
+    """本进程中实际读取地图模板文件的次数"""
+    return wordcloud_app._load_map_template.cache_info().misses
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='需要 fork')
+def test_fork_pool_shares_preloaded_state():
+    wordcloud_app.preload_shared_state()
+    loaded = map_template_loads()
+    assert loaded > 0
+
+    fork_pool = wordcloud_app.RenderPool(workers=1, queue_depth=2, timeout=30, fork=True)
+    spawn_pool = wordcloud_app.RenderPool(workers=1, queue_depth=2, timeout=30)
+    try:
+        fork_pool.start()
+        spawn_pool.start()
+        assert fork_pool.stats()['start_method'] == 'fork'
+        assert spawn_pool.stats()['start_method'] == 'spawn'
+        # fork 的进程直接使用继承的模板，spawn 的进程需要自己重新读取
+        assert fork_pool.run(map_template_loads) == loaded
+        assert spawn_pool.run(map_template_loads) == 2
+    finally:
+        fork_pool.shutdown()
+        spawn_pool.shutdown()
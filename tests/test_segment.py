@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""文档模式的分词和词频统计测试"""
+
+import wordcloud_app
+
+
+def test_simple_segment_keeps_whole_phrases():
+    """内置分词在标点和虚词处切开中文，不产生跨词的相邻两字组合"""
+    tokens = wordcloud_app.simple_segment('数据分析和机器学习是人工智能的重要领域。Data science, 2024年')
+    assert tokens == ['数据分析', '机器学习', '人工智能', '重要领域', 'Data', 'science']
+    assert '据分' not in tokens and '析和' not in tokens
+
+
+def test_simple_segment_drops_single_characters():
+    assert wordcloud_app.simple_segment('我的书 a 1 OK') == ['OK']
+
+
+def test_top_k_counter_keeps_frequent_words():
+    counter = wordcloud_app.TopKCounter(capacity=2)
+    counter.update({'alpha': 5, 'beta': 3})
+    counter.update({'gamma': 1, 'delta': 1, 'epsilon': 1})
+    counter.update({'alpha': 1, 'beta': 1})
+    assert counter.most_common(2) == [('alpha', 6), ('beta', 4)]
+    assert len(counter.counts) <= 2 * counter.capacity
+
+
+def test_count_word_frequencies_with_simple_segmenter():
+    text = '数据分析和机器学习。数据分析的方法，我们的数据分析！' * 50
+    frequencies = wordcloud_app.count_word_frequencies(text, segmenter='simple', top_n=3, chunk_size=64)
+    assert frequencies == {'数据分析': 150, '机器学习': 50, '方法': 50}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""在真实的WSGI服务器（gunicorn / waitress）下运行 serve 模式的测试"""
+
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = ['waitress'] if platform.system() == 'Windows' else ['gunicorn', 'waitress']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def call(base, path, data=None):
+    """发送请求，返回 (状态码, JSON或字节)"""
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(base + path, body, {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            payload = response.read()
+            if response.headers.get_content_type() == 'application/json':
+                payload = json.loads(payload)
+            return response.status, payload
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+# 与 `python wordcloud_app.py serve` 相同，但渲染缓存的磁盘缓存写到第一个参数指定的临时目录
+SERVE_SCRIPT = ('import sys, wordcloud_app; '
+                'wordcloud_app.render_cache = wordcloud_app.RenderCache(disk_dir=sys.argv[1]); '
+                'sys.exit(wordcloud_app.run_serve(sys.argv[2:]))')
+
+
+@pytest.fixture(params=SERVERS)
+def server(request, tmp_path):
+    pytest.importorskip(request.param)
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVE_SCRIPT, str(tmp_path / 'render_cache'), '--server', request.param,
+         '--host', '127.0.0.1', '--port', str(port), '--render-workers', '1'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(base + '/themes', timeout=5).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    pytest.fail(f'{request.param} 未能启动')
+                time.sleep(0.2)
+        yield base
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def test_follow_up_requests_reach_stored_state(server):
+    """默认配置下 /result、/recolor 和 /jobs 的后续请求都能找到之前保存的结果"""
+    for i in range(4):
+        status, result = call(server, '/generate', {
+            'text': f'alpha,beta,gamma{i}', 'width': 150, 'height': 150, 'format': 'json', 'cache': False})
+        assert status == 200
+        assert call(server, f"/result/{result['result_id']}")[0] == 200
+        assert call(server, '/recolor', {'layout_id': result['layout_id'], 'color_theme': 'plasma'})[0] == 200
+
+    status, job = call(server, '/jobs', {'text': 'x,y,z', 'width': 150, 'height': 150})
+    assert status == 202
+    deadline = time.time() + 60
+    while True:
+        status, state = call(server, f"/jobs/{job['id']}")
+        assert status == 200
+        if state['status'] in ('done', 'failed') or time.time() > deadline:
+            break
+        time.sleep(0.2)
+    assert state['status'] == 'done'
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""形状模板库测试"""
+
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import wordcloud_app
+
+
+def make_image_data():
+    img = Image.new('RGB', (300, 300), 'white')
+    img.paste((20, 20, 20), (50, 50, 250, 250))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def mask_bytes(library):
+    return sum(size for _, size, _ in library._mask_files())
+
+
+def test_mask_files_are_pruned_to_the_cap(tmp_path, monkeypatch):
+    library = wordcloud_app.TemplateLibrary(str(tmp_path))
+    meta, created = library.add(make_image_data())
+    assert created
+    monkeypatch.setattr(wordcloud_app, 'TEMPLATE_MASK_MAX_BYTES', 3 * 100 * 100 + 1024)
+
+    for size in range(100, 110):
+        mask = library.mask(meta['id'], size, size)
+        assert mask.shape[:2] == (size, size)
+        assert mask_bytes(library) <= wordcloud_app.TEMPLATE_MASK_MAX_BYTES + size * size * 4
+
+    files = sorted(os.listdir(os.path.join(str(tmp_path), meta['id'])))
+    assert 'mask_109x109.npy' in files
+    assert 'mask_100x100.npy' not in files
+    # 已删除的尺寸再次请求时重新生成
+    assert library.mask(meta['id'], 100, 100).shape[:2] == (100, 100)
+
+
+@pytest.mark.parametrize('shape', [['circle'], 7, {'id': 'tpl_0'}])
+def test_non_string_shape_is_rejected(shape):
+    params, error = wordcloud_app.parse_render_params({'text': 'a,b', 'shape': shape})
+    assert params is None and error
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""上传图片解码相关测试"""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+import wordcloud_app
+
+
+def encode_image(img, image_format='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format)
+    return f'data:image/{image_format.lower()};base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def make_upload(mode, size=(800, 800)):
+    """生成白底、中间为深色方块的测试图片，转换为指定模式"""
+    img = Image.new('RGB', size, 'white')
+    img.paste((30, 60, 200), (size[0] // 4, size[1] // 4, size[0] * 3 // 4, size[1] * 3 // 4))
+    if mode == 'P':
+        return img.convert('P', palette=Image.ADAPTIVE, colors=16)
+    if mode == 'I;16':
+        return img.convert('L').convert('I;16')
+    return img.convert(mode)
+
+
+@pytest.fixture
+def client():
+    wordcloud_app.configure_render_pool(0)
+    return wordcloud_app.app.test_client()
+
+
+@pytest.mark.parametrize('mode', ['P', '1', 'I;16', 'RGBA'])
+def test_decode_upload_reduces_any_mode(mode):
+    decoded = wordcloud_app.decode_upload(encode_image(make_upload(mode)), target_size=(200, 200))
+    assert decoded.image.size == (200, 200)
+
+
+def test_generate_with_palette_upload(client):
+    response = client.post('/generate', json={
+        'text': 'alpha,beta,gamma',
+        'shape': 'custom',
+        'image_data': encode_image(make_upload('P')),
+        'width': 200,
+        'height': 200,
+        'cache': False,
+        'format': 'binary'
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""请求参数校验测试：无效的输入返回400而不是在渲染中失败"""
+
+import json
+
+import pytest
+
+import wordcloud_app
+
+BASE = {'text': 'alpha,beta,gamma', 'width': 120, 'height': 120, 'cache': False, 'format': 'binary'}
+INVALID_FIELDS = [
+    {'background_color': 'nope'},
+    {'background_color': 5},
+    {'image_data': 123},
+    {'image_data': ['data:image/png;base64,']}
+]
+
+
+@pytest.fixture(params=[0, 1], ids=['in-process', 'render-pool'])
+def client(request):
+    wordcloud_app.configure_render_pool(request.param)
+    yield wordcloud_app.app.test_client()
+    wordcloud_app.configure_render_pool(0)
+
+
+@pytest.mark.parametrize('fields', INVALID_FIELDS)
+def test_generate_rejects_invalid_fields(client, fields):
+    response = client.post('/generate', json=dict(BASE, **fields))
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+@pytest.mark.parametrize('fields', INVALID_FIELDS)
+def test_jobs_reject_invalid_fields(client, fields):
+    assert client.post('/jobs', json=dict(BASE, **fields)).status_code == 400
+
+
+@pytest.mark.parametrize('background_color', ['#fff', 'rgb(10, 20, 30)', 'navy', None])
+def test_generate_accepts_valid_background_colors(client, background_color):
+    assert client.post('/generate', json=dict(BASE, background_color=background_color)).status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/generate', '/jobs', '/recolor', '/generate/batch', '/templates'])
+@pytest.mark.parametrize('body', ['[1, 2]', '"text"', 'not json'])
+def test_non_object_bodies_are_rejected(client, path, body):
+    response = client.post(path, data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_batch_reports_invalid_items(client):
+    response = client.post('/generate/batch', json={
+        'items': [dict(BASE, background_color='nope'), 'circle', dict(BASE, image_data=123), BASE]
+    })
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    errors = {line['index'] for line in lines if line.get('error')}
+    assert errors == {0, 1, 2}
+
+
+def test_recolor_rejects_invalid_background_color(client):
+    layout_id = client.post('/generate', json=dict(BASE, format='json')).get_json()['layout_id']
+    response = client.post('/recolor', json={'layout_id': layout_id, 'background_color': 'nope'})
+    assert response.status_code == 400
+    response = client.post('/recolor', json={'layout_id': layout_id, 'background_color': 'black', 'format': 'binary'})
+    assert response.status_code == 200
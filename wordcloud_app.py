@@ -5,22 +5,93 @@
 包含Flask应用和启动功能
 """
 
+import time
+_MODULE_LOAD_START = time.perf_counter()
+
 import subprocess
 import sys
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import numpy as np
-from wordcloud import WordCloud
-import matplotlib
-matplotlib.use('Agg')  # 设置非交互式后端
-import matplotlib.pyplot as plt
+import importlib
+import importlib.util
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, url_for, stream_with_context, g
 import io
 import base64
-from PIL import Image
 import re
 import platform
-from sklearn.cluster import KMeans
+import threading
+import functools
+import contextlib
+import hashlib
+import heapq
+import itertools
+import uuid
+import zipfile
+import csv
+import argparse
+import json
+from collections import OrderedDict, Counter
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import colorsys
+import gc
+import math
+import random
+import signal
+
+# 启动耗时记录：模块加载和延迟导入的耗时（秒）
+STARTUP_TIMINGS = OrderedDict()
+
+class LazyModule:
+    """延迟导入的模块：首次访问属性时才导入，并用真实模块替换同名全局变量"""
+
+    def __init__(self, module_name, global_name):
+        self._module_name = module_name
+        self._global_name = global_name
+
+    def __getattr__(self, attr):
+        module = timed_import(self._module_name)
+        globals()[self._global_name] = module
+        return getattr(module, attr)
+
+def timed_import(module_name):
+    """导入模块并记录首次导入的耗时
+
+    即使模块已在 sys.modules 中也要经过 import_module：其他线程可能正在导入该模块，
+    import_module 会等待导入锁，不会返回只初始化了一半的模块
+    """
+    first_import = module_name not in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if first_import:
+        STARTUP_TIMINGS.setdefault(f'import {module_name}', time.perf_counter() - start)
+    return module
+
+# numpy 和 PIL 在首次使用时才导入，只处理请求和缓存的进程不需要加载它们
+np = LazyModule('numpy', 'np')
+Image = LazyModule('PIL.Image', 'Image')
+
+def load_wordcloud_class():
+    """导入 WordCloud（同时会导入 matplotlib 和 numpy）"""
+    return timed_import('wordcloud').WordCloud
+
+def load_pyplot():
+    """导入 matplotlib.pyplot（仅 matplotlib 渲染路径需要）"""
+    matplotlib = timed_import('matplotlib')
+    matplotlib.use('Agg')  # 设置非交互式后端
+    return timed_import('matplotlib.pyplot')
+
+def startup_report():
+    """返回启动耗时报告：模块加载耗时、各延迟导入的耗时和进程内存峰值"""
+    report = dict(STARTUP_TIMINGS)
+    try:
+        import resource
+        # Linux 下 ru_maxrss 的单位为KB，macOS 下为字节
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['max_rss_mb'] = maxrss / (1024 * 1024 if platform.system() == 'Darwin' else 1024)
+    except ImportError:
+        pass
+    return report
 
 # 全局变量
 app = Flask(__name__)
@@ -68,8 +139,149 @@ COLOR_THEMES = {
     'fire': '火焰色系',
     'pastel': '柔和色系',
     'dark': '深色系',
-    'neon': '霓虹色系'
+    'neon': '霓虹色系',
+    'turbo': '明亮彩虹色系',
+    'Blues': '蓝色系',
+    'Reds': '红色系',
+    'Greens': '绿色系',
+    'Purples': '紫色系',
+    'Oranges': '橙色系',
+    'cool': '冷色调',
+    'warm': '暖色调'
+}
+
+# 不是matplotlib内置颜色映射的主题，由颜色列表定义
+CUSTOM_COLOR_THEMES = {
+    'sunset': ['#3d1f5c', '#7b2d5e', '#c8435a', '#f07e4c', '#f9b15f'],
+    'forest': ['#1b4332', '#2d6a4f', '#40916c', '#6a994e', '#8a9a3b'],
+    'fire': ['#6a040f', '#9d0208', '#d00000', '#e85d04', '#faa307'],
+    'pastel': ['#8fb9d9', '#f4a6a6', '#a8d5a2', '#c9a7e0', '#f7c59f'],
+    'dark': ['#1b263b', '#2f3e46', '#3d2c3e', '#283618', '#432818'],
+    'neon': ['#ff00a0', '#00b8d9', '#39d353', '#f5d90a', '#bc13fe'],
+    'warm': ['#b2182b', '#d6604d', '#e08214', '#f4a582', '#fdb863']
+}
+
+# 图片主色提取配置：quantize 使用PIL八叉树量化（默认），kmeans 使用scikit-learn（需另行安装）
+PALETTE_METHOD = 'quantize'
+PALETTE_CACHE_MAX_ENTRIES = 256
+DEFAULT_PALETTE = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
+
+# 上传图片限制
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024   # 解码后的图片文件大小上限
+UPLOAD_MAX_PIXELS = 40000000          # 图片像素数上限（防止解压炸弹）
+
+# 形状模板库配置（/templates 接口）
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output', 'templates')
+TEMPLATE_ID_PREFIX = 'tpl_'
+TEMPLATE_ID_PATTERN = re.compile(r'^tpl_[0-9a-f]{16}$')
+TEMPLATE_MAX_SIDE = 2048   # 模板图片保存时的最大边长
+TEMPLATE_MASK_MAX_BYTES = 256 * 1024 * 1024   # 全部模板的各尺寸掩码文件总大小上限，超出时删除最久未使用的文件
+
+# 掩码缓存配置
+MASK_CACHE_MAX_ENTRIES = 64                  # 最多缓存的掩码数量
+MASK_CACHE_MAX_BYTES = 256 * 1024 * 1024     # 掩码缓存的内存上限（字节）
+# 启动时预热的常用尺寸（宽, 高），设置为空列表可关闭预热
+MASK_WARMUP_SIZES = [(800, 400), (800, 800)]
+
+# 图片输出格式：格式名 -> (PIL格式, MIME类型, 文件扩展名)，svg 不经过PIL，由 render_svg 生成
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'svg': (None, 'image/svg+xml', 'svg')
 }
+DEFAULT_OUTPUT_FORMAT = 'png'
+PNG_COMPRESS_LEVEL = 3   # PNG压缩级别（0-9），较低的级别编码更快
+JPEG_QUALITY = 90
+WEBP_QUALITY = 90
+
+# SVG 输出内嵌的字体子集（只包含词云中用到的字符）
+SVG_FONT_FLAVOR = 'woff2' if importlib.util.find_spec('brotli') else 'woff'   # WOFF2 需要 brotli
+FONT_SUBSET_CACHE_MAX_ENTRIES = 128
+FONT_SUBSET_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# 渲染结果存储配置（供 /result/<id> 读取）
+RESULT_STORE_MAX_ENTRIES = 256
+RESULT_STORE_MAX_BYTES = 128 * 1024 * 1024
+RESULT_MAX_AGE = 3600  # /result/<id> 响应的浏览器缓存时间（秒）
+
+# /generate 的响应方式：json 内嵌base64图片，binary 直接返回图片字节，url 只返回结果地址
+RESPONSE_FORMATS = ('json', 'binary', 'url')
+
+# 渲染结果缓存配置：相同参数的 /generate 请求直接返回缓存的图片
+RENDER_CACHE_MAX_ENTRIES = 512
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RENDER_CACHE_DISK = True                     # 是否启用磁盘缓存（保存在 output/render_cache 目录）
+RENDER_CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024
+
+# 布局存储配置：布局按布局ID保存，/recolor 复用已有布局重新着色，不重新布局
+LAYOUT_STORE_MAX_ENTRIES = 256
+LAYOUT_STORE_MAX_BYTES = 64 * 1024 * 1024
+LAYOUT_SEED = 42                              # 布局使用的固定随机种子，相同参数总是得到相同的布局（请求中可用 seed 指定）
+RECOLOR_FIELDS = ('background_color', 'color_theme', 'use_image_colors')   # 只影响颜色、不影响布局的参数
+OUTPUT_FIELDS = ('output_format', 'renderer', 'quality', 'compress_level')  # 只影响输出编码的参数
+
+# 渲染进程池配置：渲染任务在独立进程中执行，充分利用多核
+RENDER_WORKERS = min(4, os.cpu_count() or 1)  # 工作进程数，0 表示在请求线程中直接渲染
+RENDER_QUEUE_DEPTH = 32                       # 最多同时排队/执行的渲染任务数
+RENDER_JOB_TIMEOUT = 60                       # 单个渲染任务的超时时间（秒）
+RENDER_KILL_GRACE = 5                         # 超时的任务在工作进程中仍未停止时，再等待该时间（秒）后重启进程池
+
+# 异步任务配置（/jobs 接口）
+JOB_RUNNERS = max(1, RENDER_WORKERS)   # 同时执行的异步任务数
+JOB_QUEUE_MAX = 100                     # 最多排队的异步任务数
+JOB_TIMEOUT = 600                       # 异步任务的超时时间（秒），大尺寸词云允许更长时间
+JOB_RETENTION = 3600                    # 已结束任务的保留时间（秒）
+
+# 生产部署配置（serve 模式，使用 gunicorn 或 waitress）
+SERVE_HOST = '0.0.0.0'
+SERVE_PORT = 5000
+# gunicorn 工作进程数。结果、布局和异步任务只保存在各进程的内存中，多个工作进程时 /result、/jobs、/recolor
+# 的后续请求可能落到其他进程而返回404，因此默认只用一个工作进程，由线程处理并发、渲染进程池利用多核
+SERVE_WORKERS = 1
+SERVE_THREADS = 4                             # 每个 gunicorn 工作进程（waitress 为整个服务器）的线程数
+SERVE_TIMEOUT = RENDER_JOB_TIMEOUT + 30       # gunicorn 工作进程处理单个请求的超时时间（秒）
+
+# 只在掩码有效区域的外接矩形内布局、并输出裁剪后图片的形状（自定义图片和模板同样只在有效区域内布局，但输出完整画布）
+MASK_BBOX_SHAPES = ('china_map', 'shanghai_map')
+
+# 快速预览：先在缩小的画布上布局并返回预览图，完整尺寸的图片复用同一布局放大绘制
+PREVIEW_MAX_SIDE = 400                  # 预览画布的最大边长
+
+# 请求限制：防止单个请求占用过多内存或CPU
+MAX_REQUEST_BYTES = 64 * 1024 * 1024    # 请求体最大字节数
+MAX_CANVAS_SIDE = 8192                  # 画布最大边长
+MAX_CANVAS_PIXELS = 16 * 1024 * 1024    # 画布最大像素数（如 4096x4096）
+MAX_TEXT_LENGTH = 10 * 1024 * 1024      # text 最大字符数（文档模式）
+MAX_LIST_WORDS = 20000                  # 逗号分隔的词汇列表最多包含的词汇数
+
+# 渲染准入控制：按预计内存占用拒绝或推迟渲染，避免进程因内存不足而卡死
+RENDER_BYTES_PER_PIXEL = 48             # 每像素的峰值内存（掩码、积分图、画布、RGB图像和编码缓冲，实测约32-50字节）
+RENDER_MEMORY_MAX_PER_REQUEST = 1024 * 1024 * 1024  # 单个渲染预计占用内存上限
+RENDER_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024       # 同时进行的渲染预计占用内存总和上限
+RENDER_RETRY_AFTER = 5                  # 服务器繁忙时建议客户端重试的间隔（秒）
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# 批量生成配置（/generate/batch 接口）
+BATCH_MAX_ITEMS = 500                   # 单次批量请求最多包含的词云数量
+BATCH_MAX_PARALLEL = max(2, RENDER_WORKERS)  # 批量请求内同时渲染的数量
+
+# 文本输入方式：list 为逗号分隔的词汇列表（按顺序确定权重），document 为原始文档（统计词频），
+# frequencies 为已统计好的词频（frequencies / frequencies_csv 参数）
+INPUT_MODES = ('list', 'document', 'frequencies')
+DEFAULT_MAX_WORDS = 100                 # 词云中最多显示的词汇数（文档模式取词频最高的前N个）
+MAX_WORDS_LIMIT = 2000                  # 单次请求 max_words 的上限
+DEFAULT_RELATIVE_SCALING = 0.5          # 词频对字号的影响程度（0-1）
+FREQUENCIES_MAX_ENTRIES = 10000         # 词频表最多包含的词汇数
+FREQUENCIES_MAX_WORD_LENGTH = 100       # 词频表中单个词汇的最大长度
+DOCUMENT_CHUNK_SIZE = 64 * 1024         # 文档模式每次处理的字符数
+DOCUMENT_COUNTER_CAPACITY = 10000       # 词频统计最多保留的词汇数，内存占用与文档大小无关
+DOCUMENT_MAX_STOPWORDS = 1000           # 单次请求最多附加的停用词数
+
+# 布局引擎配置
+DEFAULT_LAYOUT_ENGINE = 'wordcloud'     # 默认使用 WordCloud 自带的布局，可在请求中通过 layout_engine 选择
+LAYOUT_PYRAMID_BLOCKS = (16, 4)        # 加速布局的分块占用图每一级的块边长（像素）
 
 def install_requirements():
     """安装项目依赖"""
@@ -82,101 +294,308 @@ def install_requirements():
         print("❌ 依赖安装失败，请检查网络连接和权限")
         return False
 
+class LRUCache:
+    """线程安全的LRU缓存，同时限制条目数和占用内存
+
+    sizeof 用于计算每个缓存值占用的字节数
+    """
+
+    def __init__(self, max_entries, max_bytes, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, default=None):
+        """查找缓存值，未命中时返回 default"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def get(self, key, factory):
+        """获取缓存值，未命中时调用 factory() 构建并写入缓存"""
+        missing = object()
+        value = self.lookup(key, missing)
+        if value is not missing:
+            return value
+        
+        # 在锁外构建，避免阻塞其他请求
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """写入缓存，超出限制时淘汰最久未使用的条目"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def clear(self):
+        """清空缓存（计数器保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+# 各系统中 FONT_OPTIONS 对应的字体文件
+FONT_PATHS = {
+    'Windows': {
+        'simhei': 'C:/Windows/Fonts/simhei.ttf',      # 黑体
+        'simsun': 'C:/Windows/Fonts/simsun.ttc',      # 宋体
+        'msyh': 'C:/Windows/Fonts/msyh.ttc',          # 微软雅黑
+        'simkai': 'C:/Windows/Fonts/simkai.ttf',      # 楷体
+        'simfang': 'C:/Windows/Fonts/simfang.ttf',    # 仿宋
+        'simli': 'C:/Windows/Fonts/simli.ttf',        # 隶书
+        'simyou': 'C:/Windows/Fonts/simyou.ttf'       # 幼圆
+    },
+    'Darwin': {  # macOS
+        'simhei': '/System/Library/Fonts/STHeiti.ttc',      # 华文黑体
+        'simsun': '/System/Library/Fonts/STSong.ttc',        # 华文宋体
+        'msyh': '/System/Library/Fonts/PingFang.ttc',        # 苹方(类似微软雅黑)
+        'simkai': '/System/Library/Fonts/STKaiti.ttc',      # 华文楷体
+        'simfang': '/System/Library/Fonts/STFangsong.ttc',   # 华文仿宋
+        'simli': '/System/Library/Fonts/STLiti.ttc',         # 华文隶体
+        'simyou': '/System/Library/Fonts/STYuanti.ttc'       # 华文圆体
+    },
+    'Linux': {
+        'simhei': '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',  # 文泉驿微米黑
+        'simsun': '/usr/share/fonts/truetype/arphic/uming.ttc',      # 文鼎PL中楷
+        'msyh': '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',      # 文泉驿正黑
+        'simkai': '/usr/share/fonts/truetype/arphic/ukai.ttc',        # 文鼎PL上海宋
+        'simfang': '/usr/share/fonts/truetype/arphic/bsmi00lp.ttf',   # 文鼎PL报宋
+        'simli': '/usr/share/fonts/truetype/arphic/gbsn00lp.ttf',     # 文鼎PL简宋
+        'simyou': '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc'      # 文泉驿正黑
+    }
+}
+
+# 各系统中按优先级排列的中文字体（default 使用第一个可用的字体）
+CHINESE_FONT_PATHS = {
+    'Windows': [
+        'C:/Windows/Fonts/msyh.ttc',        # 微软雅黑
+        'C:/Windows/Fonts/simhei.ttf',      # 黑体
+        'C:/Windows/Fonts/simsun.ttc',      # 宋体
+        'C:/Windows/Fonts/simkai.ttf',      # 楷体
+        'C:/Windows/Fonts/simfang.ttf',    # 仿宋
+        'C:/Windows/Fonts/simli.ttf',      # 隶书
+        'C:/Windows/Fonts/simyou.ttf'       # 幼圆
+    ],
+    'Darwin': [  # macOS
+        '/System/Library/Fonts/PingFang.ttc',  # 苹方
+        '/System/Library/Fonts/STHeiti.ttc',   # 华文黑体
+        '/System/Library/Fonts/STSong.ttc',   # 华文宋体
+        '/System/Library/Fonts/STKaiti.ttc',   # 华文楷体
+        '/System/Library/Fonts/STFangsong.ttc' # 华文仿宋
+    ],
+    'Linux': [
+        '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',  # 文泉驿微米黑
+        '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',    # 文泉驿正黑
+        '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',  # Droid Sans
+        '/usr/share/fonts/truetype/arphic/uming.ttc',      # 文鼎PL中楷
+        '/usr/share/fonts/truetype/arphic/ukai.ttc'        # 文鼎PL上海宋
+    ]
+}
+
+# 字体文件不在默认位置时，按文件名在这些目录中查找
+FONT_DIRS = {
+    'Windows': ['C:/Windows/Fonts'],
+    'Darwin': ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')],
+    'Linux': ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.local/share/fonts'),
+              os.path.expanduser('~/.fonts')]
+}
+
+FONT_CACHE_MAX_ENTRIES = 256  # 缓存的字体对象（字体, 字号）数量上限
+
+class FontRegistry:
+    """字体注册表：启动时扫描一次字体目录，缓存字体路径和已加载的字体对象"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.system = platform.system()
+        self.paths = {}
+        self.default_path = None
+        self.fonts = LRUCache(FONT_CACHE_MAX_ENTRIES, float('inf'))
+        self.scanned = False
+
+    def _index_font_dirs(self):
+        """按小写文件名索引字体目录中的全部字体文件"""
+        index = {}
+        for font_dir in FONT_DIRS.get(self.system, FONT_DIRS['Linux']):
+            for root, _, files in os.walk(font_dir):
+                for filename in files:
+                    if filename.lower().endswith(('.ttf', '.ttc', '.otf')):
+                        index.setdefault(filename.lower(), os.path.join(root, filename))
+        return index
+
+    def _resolve(self, path, index):
+        if os.path.exists(path):
+            return path
+        return index.get(os.path.basename(path).lower())
+
+    def scan(self):
+        """扫描字体目录，重新解析 FONT_OPTIONS 中每种字体的路径"""
+        index = self._index_font_dirs()
+        system = self.system if self.system in FONT_PATHS else 'Linux'
+        
+        default_path = None
+        for path in CHINESE_FONT_PATHS[system]:
+            default_path = self._resolve(path, index)
+            if default_path:
+                break
+        
+        paths = {}
+        for font_name, path in FONT_PATHS[system].items():
+            resolved = self._resolve(path, index)
+            if resolved:
+                paths[font_name] = resolved
+        
+        with self._lock:
+            self.paths = paths
+            self.default_path = default_path
+            self.scanned = True
+        self.fonts.clear()
+        return self.available()
+
+    def _ensure_scanned(self):
+        if not self.scanned:
+            self.scan()
+
+    def get_path(self, font_name):
+        """返回字体路径，指定的字体不存在时返回默认中文字体路径（可能为None）"""
+        self._ensure_scanned()
+        with self._lock:
+            if font_name != 'default' and font_name in self.paths:
+                return self.paths[font_name]
+            return self.default_path
+
+    def available(self):
+        """返回已安装的字体选项 {键: 名称}，default 始终可用"""
+        self._ensure_scanned()
+        with self._lock:
+            return {key: label for key, label in FONT_OPTIONS.items()
+                    if key == 'default' or key in self.paths}
+
+    def get_font(self, font_path, size):
+        """返回指定字体文件和字号的 FreeTypeFont 对象（按字体路径和准确的字号缓存）
+
+        加速布局引擎和SVG输出通过这里加载字体；WordCloud 自带的布局和绘制在内部按路径打开字体，不经过缓存
+        """
+        from PIL import ImageFont
+        return self.fonts.get(
+            (font_path, size),
+            lambda: ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default()
+        )
+
+    def preload(self):
+        """扫描字体目录并解析全部字体选项的路径"""
+        self._ensure_scanned()
+
+font_registry = FontRegistry()
+
 def get_font_by_name(font_name):
-    """根据字体名称获取字体路径"""
-    system = platform.system()
-    
-    if font_name == 'default':
-        return get_chinese_font()  # 使用系统中可用的中文字体
-    
-    if system == 'Windows':
-        font_paths = {
-            'simhei': 'C:/Windows/Fonts/simhei.ttf',      # 黑体
-            'simsun': 'C:/Windows/Fonts/simsun.ttc',      # 宋体
-            'msyh': 'C:/Windows/Fonts/msyh.ttc',          # 微软雅黑
-            'simkai': 'C:/Windows/Fonts/simkai.ttf',      # 楷体
-            'simfang': 'C:/Windows/Fonts/simfang.ttf',    # 仿宋
-            'simli': 'C:/Windows/Fonts/simli.ttf',        # 隶书
-            'simyou': 'C:/Windows/Fonts/simyou.ttf'       # 幼圆
-        }
-    elif system == 'Darwin':  # macOS
-        font_paths = {
-            'simhei': '/System/Library/Fonts/STHeiti.ttc',      # 华文黑体
-            'simsun': '/System/Library/Fonts/STSong.ttc',        # 华文宋体
-            'msyh': '/System/Library/Fonts/PingFang.ttc',        # 苹方(类似微软雅黑)
-            'simkai': '/System/Library/Fonts/STKaiti.ttc',      # 华文楷体
-            'simfang': '/System/Library/Fonts/STFangsong.ttc',   # 华文仿宋
-            'simli': '/System/Library/Fonts/STLiti.ttc',         # 华文隶体
-            'simyou': '/System/Library/Fonts/STYuanti.ttc'       # 华文圆体
-        }
-    else:  # Linux
-        font_paths = {
-            'simhei': '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',  # 文泉驿微米黑
-            'simsun': '/usr/share/fonts/truetype/arphic/uming.ttc',      # 文鼎PL中楷
-            'msyh': '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',      # 文泉驿正黑
-            'simkai': '/usr/share/fonts/truetype/arphic/ukai.ttc',        # 文鼎PL上海宋
-            'simfang': '/usr/share/fonts/truetype/arphic/bsmi00lp.ttf',   # 文鼎PL报宋
-            'simli': '/usr/share/fonts/truetype/arphic/gbsn00lp.ttf',     # 文鼎PL简宋
-            'simyou': '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc'      # 文泉驿正黑
-        }
-    
-    # 返回对应的字体路径，如果不存在则返回系统中可用的中文字体
-    font_path = font_paths.get(font_name, None)
-    if font_path and os.path.exists(font_path):
-        return font_path
-    
-    # 如果指定的字体不存在，返回系统中可用的中文字体
-    return get_chinese_font()
+    """根据字体名称获取字体路径（如果指定的字体不存在，返回系统中可用的中文字体）"""
+    return font_registry.get_path(font_name)
 
 def get_chinese_font():
-    """获取支持中文的字体路径"""
-    system = platform.system()
-    
-    if system == 'Windows':
-        # Windows系统常见中文字体
-        font_paths = [
-            'C:/Windows/Fonts/msyh.ttc',        # 微软雅黑
-            'C:/Windows/Fonts/simhei.ttf',      # 黑体
-            'C:/Windows/Fonts/simsun.ttc',      # 宋体
-            'C:/Windows/Fonts/simkai.ttf',      # 楷体
-            'C:/Windows/Fonts/simfang.ttf',    # 仿宋
-            'C:/Windows/Fonts/simli.ttf',      # 隶书
-            'C:/Windows/Fonts/simyou.ttf'       # 幼圆
-        ]
-    elif system == 'Darwin':  # macOS
-        font_paths = [
-            '/System/Library/Fonts/PingFang.ttc',  # 苹方
-            '/System/Library/Fonts/STHeiti.ttc',   # 华文黑体
-            '/System/Library/Fonts/STSong.ttc',   # 华文宋体
-            '/System/Library/Fonts/STKaiti.ttc',   # 华文楷体
-            '/System/Library/Fonts/STFangsong.ttc' # 华文仿宋
-        ]
-    else:  # Linux
-        font_paths = [
-            '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',  # 文泉驿微米黑
-            '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',    # 文泉驿正黑
-            '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',  # Droid Sans
-            '/usr/share/fonts/truetype/arphic/uming.ttc',      # 文鼎PL中楷
-            '/usr/share/fonts/truetype/arphic/ukai.ttc'        # 文鼎PL上海宋
-        ]
+    """获取支持中文的字体路径，没有找到时返回None，使用默认字体"""
+    return font_registry.get_path('default')
+
+class InputError(ValueError):
+    """请求的输入内容无效（返回400）"""
+
+class UploadError(InputError):
+    """上传的图片无效或超出限制"""
+
+class DecodedUpload:
+    """解码后的上传图片，供掩码和颜色提取共用"""
+
+    def __init__(self, image, digest):
+        self.image = image
+        self.digest = digest
+
+def decode_upload(image_data, target_size=None):
+    """解码上传的base64图片（每个请求只解码一次），并校验大小和像素数
+
+    target_size 为 (宽, 高) 时，大尺寸图片会在解码阶段直接缩小（JPEG使用draft，其他格式使用reduce），
+    缩小后的尺寸不小于 target_size
+    """
+    if not isinstance(image_data, str):
+        raise UploadError('图片数据必须是base64编码的文本')
+    # 移除data:image/...;base64,前缀，解码前先按base64长度估算图片大小
+    payload = image_data.split(',', 1)[1] if ',' in image_data else image_data
+    if len(payload) * 3 // 4 > UPLOAD_MAX_BYTES:
+        raise UploadError(f'图片文件大小不能超过 {UPLOAD_MAX_BYTES // (1024 * 1024)}MB')
+    try:
+        image_bytes = base64.b64decode(payload)
+    except ValueError:
+        raise UploadError('图片数据不是有效的base64编码')
+    
+    # Image.open只读取文件头，可以在解码像素之前检查尺寸，防止解压炸弹
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+    except Exception:
+        raise UploadError('无法识别的图片格式')
+    if img.width * img.height > UPLOAD_MAX_PIXELS:
+        raise UploadError(f'图片像素数不能超过 {UPLOAD_MAX_PIXELS}')
     
-    # 检查字体文件是否存在
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            return font_path
+    if target_size:
+        # JPEG可以在解码时按1/2、1/4、1/8缩小，几乎没有额外开销
+        img.draft('RGB' if img.mode == 'RGB' else img.mode, target_size)
+    img.load()
+    if target_size:
+        factor = min(img.width // target_size[0], img.height // target_size[1])
+        if factor >= 2:
+            # reduce 不支持 P、1、I;16 等模式，先转换为灰度或RGB(A)
+            if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                if img.mode in ('1', 'I', 'I;16', 'F'):
+                    img = img.convert('L')
+                elif img.mode == 'PA' or 'transparency' in img.info:
+                    img = img.convert('RGBA')
+                else:
+                    img = img.convert('RGB')
+            img = img.reduce(factor)
     
-    # 如果没有找到，返回None，使用默认字体
-    return None
+    return DecodedUpload(img, hashlib.sha256(image_bytes).hexdigest())
 
-def create_mask_from_image(image_data, width, height):
-    """从上传的图片创建掩码"""
-    # 解码base64图片数据
-    image_data = image_data.split(',')[1]  # 移除data:image/...;base64,前缀
-    image_bytes = base64.b64decode(image_data)
-    
-    # 打开图片并转换为灰度图
-    img = Image.open(io.BytesIO(image_bytes))
-    img = img.convert('L')  # 转换为灰度图
+def create_mask_from_image(img, width, height):
+    """从上传的图片（已解码的PIL图像）创建掩码"""
+    # 转换为灰度图
+    img = img.convert('L')
     
     # 调整图片大小到目标尺寸
     img = img.resize((width, height))
@@ -190,53 +609,501 @@ def create_mask_from_image(image_data, width, height):
     
     return mask
 
-def extract_colors_from_image(image_data, n_colors=5):
-    """从图片中提取主要颜色"""
+def _kmeans_palette(img, n_colors):
+    """使用K-means聚类提取主要颜色（需要scikit-learn）"""
+    from sklearn.cluster import KMeans
+    pixels = np.array(img).reshape(-1, 3)
+    kmeans = KMeans(n_clusters=n_colors, random_state=42)
+    kmeans.fit(pixels)
+    return [tuple(int(np.clip(c, 0, 255)) for c in color) for color in kmeans.cluster_centers_]
+
+def _quantize_palette(img, n_colors):
+    """使用PIL八叉树量化提取主要颜色，按像素数量从多到少排列"""
+    quantized = img.quantize(colors=n_colors, method=Image.Quantize.FASTOCTREE)
+    palette = quantized.getpalette()
+    counts = sorted(quantized.getcolors(), key=lambda item: (-item[0], item[1]))
+    colors = [tuple(palette[index * 3:index * 3 + 3]) for _, index in counts]
+    # 图片颜色数少于 n_colors 时循环补足，保持返回数量不变
+    return [colors[i % len(colors)] for i in range(n_colors)]
+
+def _extract_palette(img, n_colors):
+    # 转换为RGB模式，缩小以加快处理速度
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = img.resize((150, 150))
+    
+    colors = None
+    if PALETTE_METHOD == 'kmeans':
+        try:
+            colors = _kmeans_palette(img, n_colors)
+        except ImportError:
+            print("未安装scikit-learn，改用PIL量化提取颜色")
+    if colors is None:
+        colors = _quantize_palette(img, n_colors)
+    
+    # 将颜色转换为十六进制格式
+    return tuple('#{:02x}{:02x}{:02x}'.format(r, g, b) for r, g, b in colors)
+
+palette_cache = LRUCache(PALETTE_CACHE_MAX_ENTRIES, float('inf'))
+
+def extract_colors_from_image(upload, n_colors=5):
+    """从上传的图片（DecodedUpload）中提取主要颜色，结果按图片摘要缓存"""
     try:
-        # 解码base64图片数据
-        image_data = image_data.split(',')[1]  # 移除data:image/...;base64,前缀
-        image_bytes = base64.b64decode(image_data)
-        
-        # 打开图片
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # 转换为RGB模式（如果不是）
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # 调整图片大小以加快处理速度
-        img = img.resize((150, 150))
-        
-        # 转换为numpy数组并重塑为像素列表
-        img_array = np.array(img)
-        pixels = img_array.reshape(-1, 3)
-        
-        # 使用K-means聚类提取主要颜色
-        kmeans = KMeans(n_clusters=n_colors, random_state=42)
-        kmeans.fit(pixels)
-        
-        # 获取聚类中心（主要颜色）
-        colors = kmeans.cluster_centers_
-        
-        # 将颜色转换为十六进制格式
-        hex_colors = []
-        for color in colors:
-            # 确保值在0-255范围内
-            r = int(np.clip(color[0], 0, 255))
-            g = int(np.clip(color[1], 0, 255))
-            b = int(np.clip(color[2], 0, 255))
-            hex_color = '#{:02x}{:02x}{:02x}'.format(r, g, b)
-            hex_colors.append(hex_color)
-        
-        return hex_colors
+        colors = palette_cache.get((upload.digest, n_colors, PALETTE_METHOD),
+                                   lambda: _extract_palette(upload.image, n_colors))
+        return list(colors)
     except Exception as e:
         print(f"颜色提取错误: {str(e)}")
         # 如果颜色提取失败，返回默认颜色
-        return ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
+        return list(DEFAULT_PALETTE)
+
+# 形状掩码注册表：形状名 -> (构建函数, 是否反转)
+# 构建函数签名为 builder(width, height)，返回布尔数组（True 表示形状内部），
+# 返回 None 表示不需要掩码（如矩形）
+MASK_BUILDERS = {}
+
+def register_shape(name, invert=True):
+    """注册形状掩码构建函数的装饰器
+
+    invert 为 True 时，形状内部会被转换为 WordCloud 可填充的黑色区域(0)
+    """
+    def decorator(builder):
+        MASK_BUILDERS[name] = (builder, invert)
+        return builder
+    return decorator
+
+def _centered_grid(width, height, center_x=None, center_y=None):
+    """构建以中心为原点的广播坐标网格 (dx 为 1xW，dy 为 Hx1)"""
+    if center_x is None:
+        center_x = width // 2
+    if center_y is None:
+        center_y = height // 2
+    dy, dx = np.ogrid[0:height, 0:width]
+    return dx - center_x, dy - center_y
+
+def _polar_grid(width, height):
+    """构建极坐标网格，返回 (距离, 0-2π 范围内的角度)"""
+    dx, dy = _centered_grid(width, height)
+    distance = np.sqrt(dx**2 + dy**2)
+    angle = np.arctan2(dy, dx)
+    # 将角度映射到0-2π范围
+    angle = np.where(angle < 0, angle + 2 * np.pi, angle)
+    return distance, angle
+
+def _regular_polygon_mask(width, height, sector_angle, inner_ratio):
+    """按扇区奇偶使用完整半径或缩小半径构建正多边形掩码"""
+    radius = min(width, height) // 2 - 10
+    distance, angle = _polar_grid(width, height)
+    sector = np.floor(angle / sector_angle).astype(np.int64)
+    radius_at_angle = np.where(sector % 2 == 0, radius, radius * inner_ratio)
+    return (distance > 0) & (distance <= radius_at_angle)
+
+@register_shape('rectangle')
+def _rectangle_mask(width, height):
+    """矩形不需要特殊掩码"""
+    return None
+
+@register_shape('circle')
+def _circle_mask(width, height):
+    """创建圆形掩码"""
+    radius = min(width, height) // 2 - 10
+    dx, dy = _centered_grid(width, height)
+    return np.sqrt(dx**2 + dy**2) <= radius
+
+@register_shape('triangle')
+def _triangle_mask(width, height):
+    """创建三角形掩码：顶部宽度为0，底部宽度为width"""
+    center_x = width // 2
+    # 三角形宽度随高度线性增加
+    width_at_row = (width * (np.arange(height) / height)).astype(np.int64)
+    start_x = center_x - width_at_row // 2
+    end_x = center_x + width_at_row // 2
+    cols = np.arange(width)
+    return ((width_at_row[:, None] > 0)
+            & (cols >= start_x[:, None])
+            & (cols < end_x[:, None]))
+
+@register_shape('heart')
+def _heart_mask(width, height):
+    """创建心形掩码 - 使用心形方程，并旋转180度（倒置）"""
+    # 稍微上移心形
+    dx, dy = _centered_grid(width, height, center_y=height // 2 - height // 10)
+    x = dx / (width / 3)
+    # 旋转180度相当于将y坐标取反
+    y = -(dy / (height / 3))
+    heart = (x**2 + y**2 - 1)**3 - x**2 * y**3
+    return heart <= 0
+
+@register_shape('star')
+def _star_mask(width, height):
+    """创建星形掩码：10个顶点（5个外顶点，5个内顶点），每36度一个扇区"""
+    outer_radius = min(width, height) // 2 - 10
+    distance, angle = _polar_grid(width, height)
+    step = np.pi / 5
+    sector = np.floor(angle / step).astype(np.int64)
+    ratio = (angle - sector * step) / step
+    # 偶数扇区从外顶点到内顶点，奇数扇区从内顶点到外顶点
+    radius_at_angle = np.where(
+        sector % 2 == 0,
+        outer_radius - (outer_radius * 0.6) * ratio,
+        outer_radius * 0.4 + (outer_radius * 0.6) * ratio,
+    )
+    return (distance > 0) & (distance <= radius_at_angle)
+
+@register_shape('hexagon')
+def _hexagon_mask(width, height):
+    """创建六边形掩码，每60度一个扇区"""
+    return _regular_polygon_mask(width, height, np.pi / 3, 0.866)  # cos(30°) ≈ 0.866
+
+@register_shape('pentagon')
+def _pentagon_mask(width, height):
+    """创建五边形掩码，每72度一个扇区"""
+    return _regular_polygon_mask(width, height, 2 * np.pi / 5, 0.7265)  # cos(36°) ≈ 0.7265
+
+@register_shape('octagon')
+def _octagon_mask(width, height):
+    """创建八边形掩码，每45度一个扇区"""
+    return _regular_polygon_mask(width, height, np.pi / 4, 0.7071)  # cos(45°) ≈ 0.7071
+
+@register_shape('ellipse')
+def _ellipse_mask(width, height):
+    """创建椭圆形掩码：(x/a)^2 + (y/b)^2 <= 1"""
+    a = width // 2 - 10  # x轴半长轴
+    b = height // 2 - 10  # y轴半短轴
+    if a == 0 or b == 0:
+        raise ZeroDivisionError('画布尺寸过小，无法创建椭圆形掩码')
+    dx, dy = _centered_grid(width, height)
+    return (dx**2 / a**2) + (dy**2 / b**2) <= 1
+
+@register_shape('diamond')
+def _diamond_mask(width, height):
+    """创建菱形掩码：|x|/a + |y|/b <= 1"""
+    size = min(width, height) // 2 - 10
+    if size == 0:
+        raise ZeroDivisionError('画布尺寸过小，无法创建菱形掩码')
+    dx, dy = _centered_grid(width, height)
+    return (np.abs(dx) / size) + (np.abs(dy) / size) <= 1
 
-def create_wordcloud(text, shape='circle', width=800, height=400, background_color='white', image_data=None, use_image_colors=False, font_name='default', color_theme='viridis'):
-    """创建词云图"""
-    # 处理文本，逗号分隔
+@functools.lru_cache(maxsize=None)
+def _load_map_template(filename):
+    """加载并解码地图模板图片（每个进程只读取一次）"""
+    map_path = os.path.join(os.path.dirname(__file__), filename)
+    map_img = Image.open(map_path)
+    map_img.load()
+    return map_img
+
+def _map_template_mask(filename, width, height, bright_inside):
+    """将地图图片按纵横比缩放后居中放置，生成地图掩码"""
+    map_img = _load_map_template(filename)
+
+    # 根据请求的尺寸和图片纵横比计算实际尺寸
+    img_width, img_height = map_img.size
+    aspect_ratio = img_width / img_height
+    if width / height > aspect_ratio:
+        # 请求的宽度相对于高度太大，以高度为准
+        new_height = height
+        new_width = int(height * aspect_ratio)
+    else:
+        # 请求的高度相对于宽度太大，以宽度为准
+        new_width = width
+        new_height = int(width / aspect_ratio)
+
+    # 调整图片大小，保持纵横比，并转换为灰度图像
+    map_array = np.array(map_img.resize((new_width, new_height), Image.LANCZOS).convert('L'))
+
+    # 将缩放后的地图居中放置在与请求尺寸相同的空白掩码中
+    mask = np.zeros((height, width), dtype=bool)
+    offset_x = (width - new_width) // 2
+    offset_y = (height - new_height) // 2
+    region = map_array > 128 if bright_inside else map_array < 128
+    mask[offset_y:offset_y+new_height, offset_x:offset_x+new_width] = region
+    return mask
+
+def _fallback_mask(width, height):
+    """地图模板加载失败时使用的矩形后备掩码"""
+    mask = np.zeros((height, width), dtype=bool)
+    mask[height//4:3*height//4, width//4:3*width//4] = True
+    return mask
+
+@register_shape('china_map')
+def _china_map_mask(width, height):
+    """使用chinamap.jpg作为中国地图模板"""
+    try:
+        return _map_template_mask('chinamap.jpg', width, height, bright_inside=False)
+    except Exception as e:
+        print(f"加载中国地图模板失败: {e}")
+        return _fallback_mask(width, height)
+
+# 上海地图直接使用布尔掩码，不需要反转
+@register_shape('shanghai_map', invert=False)
+def _shanghai_map_mask(width, height):
+    """使用shanghai.png作为上海地图模板（较亮的区域设为True）"""
+    try:
+        return _map_template_mask('shanghai.png', width, height, bright_inside=True)
+    except Exception as e:
+        print(f"加载上海地图模板失败: {e}")
+        return _fallback_mask(width, height)
+
+def shape_mask_to_wordcloud(mask, invert=True):
+    """将布尔掩码转换为WordCloud使用的整数掩码（0和255）
+
+    WordCloud中，白色区域(255)是词云不能填充的区域，黑色区域(0)是可以填充的区域
+    """
+    if mask is None:
+        return None
+    if invert:
+        # 反转掩码：True(形状内) -> 0(黑色)，False(形状外) -> 255(白色)
+        return (~mask).astype(np.uint8) * 255
+    return mask.astype(np.uint8) * 255
+
+def build_shape_mask(shape, width, height):
+    """根据形状名称构建WordCloud掩码，未注册的形状返回None"""
+    entry = MASK_BUILDERS.get(shape)
+    if entry is None:
+        return None
+    builder, invert = entry
+    return shape_mask_to_wordcloud(builder(width, height), invert)
+
+def _mask_nbytes(mask):
+    return mask.nbytes if mask is not None else 0
+
+def _build_readonly_mask(shape, width, height):
+    """构建掩码并设置为只读，以便在多个请求之间共享"""
+    mask = build_shape_mask(shape, width, height)
+    if mask is not None:
+        mask.setflags(write=False)
+    return mask
+
+mask_cache = LRUCache(MASK_CACHE_MAX_ENTRIES, MASK_CACHE_MAX_BYTES, sizeof=_mask_nbytes)
+
+def get_shape_mask(shape, width, height):
+    """获取形状掩码（优先从LRU缓存读取），返回的数组为只读
+
+    除内置形状外，shape 也可以是模板库中的模板ID
+    """
+    if shape in MASK_BUILDERS:
+        return mask_cache.get((shape, width, height),
+                              lambda: _build_readonly_mask(shape, width, height))
+    if template_library.exists(shape):
+        return mask_cache.get((shape, width, height),
+                              lambda: template_library.mask(shape, width, height))
+    return None
+
+def warm_mask_cache(sizes=None, shapes=None):
+    """预热常用尺寸的形状掩码"""
+    sizes = MASK_WARMUP_SIZES if sizes is None else sizes
+    shapes = list(MASK_BUILDERS) if shapes is None else shapes
+    for width, height in sizes:
+        for shape in shapes:
+            get_shape_mask(shape, width, height)
+
+class TemplateLibrary:
+    """上传的形状模板库
+
+    模板按图片内容去重，每个模板保存为目录 <模板ID>/：
+    template.png 为预处理后的灰度图，meta.json 为模板信息，
+    mask_<宽>x<高>.npy 为各尺寸的掩码（以内存映射方式读取，多个进程共享同一份文件）
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _dir(self, template_id):
+        return os.path.join(self.root, template_id)
+
+    def exists(self, template_id):
+        if not isinstance(template_id, str) or not TEMPLATE_ID_PATTERN.match(template_id):
+            return False
+        return os.path.isfile(os.path.join(self._dir(template_id), 'meta.json'))
+
+    def add(self, image_data, name=None):
+        """保存上传的模板，返回 (模板信息, 是否新建)；相同内容的图片返回已有模板"""
+        upload = decode_upload(image_data, (TEMPLATE_MAX_SIDE, TEMPLATE_MAX_SIDE))
+        template_id = f'{TEMPLATE_ID_PREFIX}{upload.digest[:16]}'
+        with self._lock:
+            if self.exists(template_id):
+                return self.get(template_id), False
+            
+            # 预处理：限制尺寸并转换为灰度图，同时提取颜色供 use_image_colors 使用
+            img = upload.image.copy()
+            img.thumbnail((TEMPLATE_MAX_SIDE, TEMPLATE_MAX_SIDE))
+            gray = img.convert('L')
+            meta = {
+                'id': template_id,
+                'name': name or template_id,
+                'width': gray.width,
+                'height': gray.height,
+                'colors': extract_colors_from_image(upload),
+                'created_at': time.time()
+            }
+            
+            # 先写入临时目录再重命名，避免其他进程读取到不完整的模板
+            template_dir = self._dir(template_id)
+            tmp_dir = f'{template_dir}.{os.getpid()}.{threading.get_ident()}.tmp'
+            os.makedirs(tmp_dir, exist_ok=True)
+            gray.save(os.path.join(tmp_dir, 'template.png'))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_dir, template_dir)
+            return meta, True
+
+    def get(self, template_id):
+        """返回模板信息，不存在时返回None"""
+        if not self.exists(template_id):
+            return None
+        with open(os.path.join(self._dir(template_id), 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self):
+        """返回全部模板信息，按创建时间排列"""
+        templates = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return templates
+        for template_id in names:
+            meta = self.get(template_id)
+            if meta is not None:
+                templates.append(meta)
+        templates.sort(key=lambda meta: meta['created_at'])
+        return templates
+
+    def image_path(self, template_id):
+        return os.path.join(self._dir(template_id), 'template.png')
+
+    def colors(self, template_id):
+        meta = self.get(template_id)
+        return meta['colors'] if meta else None
+
+    def mask(self, template_id, width, height):
+        """返回指定尺寸的WordCloud掩码（只读内存映射），首次请求该尺寸时生成掩码文件
+
+        掩码文件的修改时间记录最近一次使用，总大小超过 TEMPLATE_MASK_MAX_BYTES 时删除最久未使用的文件
+        """
+        mask_path = os.path.join(self._dir(template_id), f'mask_{width}x{height}.npy')
+        try:
+            mask = np.load(mask_path, mmap_mode='r')
+            os.utime(mask_path)
+            return mask
+        except FileNotFoundError:
+            pass
+        
+        with Image.open(self.image_path(template_id)) as img:
+            mask = shape_mask_to_wordcloud(create_mask_from_image(img, width, height))
+        tmp_path = f'{mask_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, mask)
+        os.replace(tmp_path, mask_path)
+        self._prune_masks(keep=mask_path)
+        return np.load(mask_path, mmap_mode='r')
+
+    def _mask_files(self):
+        """返回全部模板的掩码文件列表 [(修改时间, 大小, 路径)]"""
+        files = []
+        try:
+            template_dirs = list(os.scandir(self.root))
+        except OSError:
+            return files
+        for template_dir in template_dirs:
+            if not template_dir.is_dir():
+                continue
+            try:
+                entries = list(os.scandir(template_dir.path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('mask_') and entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _prune_masks(self, keep=None):
+        """掩码文件总大小超出上限时删除最久未使用的文件（keep 为刚生成的文件，不删除）
+
+        其他进程仍以内存映射方式打开的文件删除后映射依然有效；无法删除时（Windows）跳过
+        """
+        files = self._mask_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= TEMPLATE_MASK_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+template_library = TemplateLibrary(TEMPLATE_DIR)
+
+@contextlib.contextmanager
+def stage(timings, name):
+    """记录代码块的耗时（秒）到 timings 字典，同名阶段累加；timings 为None时不计时"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+def _frequency_weight(value):
+    """把词频表中的权重转换为正数，无效时返回None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        return None
+    return weight if math.isfinite(weight) and weight > 0 else None
+
+def parse_frequencies(value):
+    """解析 {词语: 权重} 或 [[词语, 权重], ...] 格式的词频，返回 (词频字典, 错误信息)；重复的词语权重相加"""
+    if isinstance(value, dict):
+        entries = value.items()
+    elif isinstance(value, list):
+        if not all(isinstance(entry, (list, tuple)) and len(entry) == 2 for entry in value):
+            return None, 'frequencies 数组的每一项必须是 [词语, 权重]'
+        entries = value
+    else:
+        return None, 'frequencies 必须是对象或 [[词语, 权重], ...] 数组'
+    
+    if len(entries) > FREQUENCIES_MAX_ENTRIES:
+        return None, f'词频表不能超过 {FREQUENCIES_MAX_ENTRIES} 个词'
+    
+    word_freq = {}
+    for word, weight in entries:
+        word = word.strip() if isinstance(word, str) else ''
+        if not word or len(word) > FREQUENCIES_MAX_WORD_LENGTH:
+            return None, f'无效的词语: {str(word)[:20]}'
+        weight = _frequency_weight(weight)
+        if weight is None:
+            return None, f'词语 {word} 的权重必须是正数'
+        word_freq[word] = word_freq.get(word, 0) + weight
+    return word_freq, None
+
+def parse_frequency_table(content):
+    """解析CSV/TSV格式的词频表（每行 词语,权重，首行可以是表头），返回 (词频字典, 错误信息)"""
+    lines = content.splitlines()
+    if not lines:
+        return None, '词频表为空'
+    delimiter = '\t' if '\t' in lines[0] else ','
+    rows = [row for row in csv.reader(lines, delimiter=delimiter) if any(cell.strip() for cell in row)]
+    # 首行的权重不是数字时视为表头
+    if rows and len(rows[0]) >= 2 and _frequency_weight(rows[0][1]) is None:
+        rows = rows[1:]
+    if not all(len(row) >= 2 for row in rows):
+        return None, '词频表的每一行必须包含词语和权重两列'
+    return parse_frequencies([row[:2] for row in rows])
+
+def parse_word_list(text):
+    """解析逗号分隔的词汇列表，越靠前的词汇权重越大"""
     words = text.split(',')
     word_freq = {}
     
@@ -247,506 +1114,2220 @@ def create_wordcloud(text, shape='circle', width=800, height=400, background_col
             # 根据位置分配权重，越靠前权重越大
             weight = len(words) - i
             word_freq[word] = weight
+    return word_freq
+
+# 分词器注册表：名称 -> 分词函数（输入一段文本，产出词语）
+SEGMENTERS = {}
+
+def register_segmenter(name, module=None):
+    """注册分词器，module 为分词器依赖的可选模块，未安装时该分词器不可用"""
+    def decorator(func):
+        SEGMENTERS[name] = (func, module)
+        return func
+    return decorator
+
+# 词语过滤：至少两个字母的英文单词，或至少两个汉字的中文词语（数字和单字不计入）
+TOKEN_PATTERN = re.compile(r"[A-Za-z][A-Za-z']+|[\u4e00-\u9fff]{2,}")
+# 常见的单字虚词（助词、连词等），内置分词没有词典，只在这些字处把连续的汉字切开
+CJK_FUNCTION_CHARS = '的了和与及或是也都把被着吗呢吧啊'
+SIMPLE_TOKEN_PATTERN = re.compile(
+    rf"[A-Za-z][A-Za-z']+|(?:(?![{CJK_FUNCTION_CHARS}])[\u4e00-\u9fff]){{2,}}"
+)
+
+@register_segmenter('simple')
+def simple_segment(text):
+    """内置分词：英文按单词切分，中文在标点和常见虚词处切开，切出的短语整体计数（准确分词请安装 jieba）"""
+    return SIMPLE_TOKEN_PATTERN.findall(text)
+
+@register_segmenter('jieba', module='jieba')
+def jieba_segment(text):
+    """jieba 中文分词（需要安装 jieba）"""
+    for token in timed_import('jieba').cut(text):
+        if TOKEN_PATTERN.fullmatch(token):
+            yield token
+
+def available_segmenters():
+    """返回当前环境可用的分词器名称"""
+    return [name for name, (_, module) in SEGMENTERS.items()
+            if module is None or importlib.util.find_spec(module) is not None]
+
+def default_segmenter():
+    """默认分词器：安装了 jieba 时使用 jieba，否则使用内置分词"""
+    return 'jieba' if 'jieba' in available_segmenters() else 'simple'
+
+# 常见的中文停用词，英文停用词使用 wordcloud 自带的 STOPWORDS
+CHINESE_STOPWORDS = frozenset(
+    '我们 你们 他们 她们 它们 这个 那个 这些 那些 这样 那样 这里 那里 什么 怎么 为什么 因为 所以 但是 而且 '
+    '如果 虽然 然后 还是 或者 以及 已经 可以 没有 不是 就是 还有 一个 一些 自己 这种 进行 通过 对于 关于 '
+    '之后 之前 其中 以上 以下 由于 并且 不过 只是 的话 一样 非常 可能 应该 需要'.split()
+)
+
+def get_stopwords(extra=None):
+    """停用词集合：wordcloud 的英文停用词、常见中文停用词和请求中附加的停用词"""
+    stopwords = set(timed_import('wordcloud').STOPWORDS) | CHINESE_STOPWORDS
+    if extra:
+        stopwords.update(word.strip().lower() for word in extra)
+    return stopwords
+
+def iter_text_chunks(source, chunk_size=DOCUMENT_CHUNK_SIZE):
+    """把字符串或文本文件对象切成固定大小的块，文件不会一次性读入内存"""
+    if isinstance(source, str):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+# 匹配到最后一个分隔符（空白或标点）为止的前缀，块在这里切开以免把词语拆到两块中
+LAST_BOUNDARY_PATTERN = re.compile(r'.*[\s,.;:!?"\'()\[\]，。；：！？、“”‘’（）《》【】]', re.S)
+
+def iter_text_segments(source, chunk_size=DOCUMENT_CHUNK_SIZE):
+    """按块读取文本，在分隔符处切开，产出不会截断词语的文本段"""
+    pending = ''
+    for chunk in iter_text_chunks(source, chunk_size):
+        buffer = pending + chunk
+        match = LAST_BOUNDARY_PATTERN.match(buffer)
+        cut = match.end() if match else 0
+        # 长时间没有分隔符时强制切开，保证内存占用有上限
+        if cut == 0 and len(buffer) > 4 * chunk_size:
+            cut = len(buffer)
+        if cut:
+            yield buffer[:cut]
+        pending = buffer[cut:]
+    if pending:
+        yield pending
+
+class TopKCounter:
+    """有上限的词频计数：词汇数超过 2 × capacity 时只保留计数最高的 capacity 个
+
+    高频词在每一段文本中都会累计计数而被保留，结果为近似的前K个高频词，内存占用与文档大小无关
+    """
+
+    def __init__(self, capacity=DOCUMENT_COUNTER_CAPACITY):
+        self.capacity = capacity
+        self.counts = Counter()
+
+    def update(self, counts):
+        """合并一段文本的词频 {词语: 次数}"""
+        self.counts.update(counts)
+        if len(self.counts) > 2 * self.capacity:
+            self.counts = Counter(dict(self.counts.most_common(self.capacity)))
+
+    def most_common(self, n):
+        """返回计数最高的 n 个 (词语, 计数)"""
+        return self.counts.most_common(n)
+
+def count_word_frequencies(source, segmenter=None, stopwords=None, top_n=DEFAULT_MAX_WORDS,
+                           chunk_size=DOCUMENT_CHUNK_SIZE):
+    """统计文档（字符串或文本文件对象）中的词频，返回词频最高的 top_n 个词 {词语: 次数}"""
+    segment = SEGMENTERS[segmenter or default_segmenter()][0]
+    stopwords = get_stopwords(stopwords)
+    counter = TopKCounter(max(top_n, DOCUMENT_COUNTER_CAPACITY))
+    for text in iter_text_segments(source, chunk_size):
+        # 先在每一段内计数（Counter 在C层面计数），再去掉停用词后合并
+        segment_counts = Counter(segment(text.lower()))
+        for word in stopwords.intersection(segment_counts):
+            del segment_counts[word]
+        counter.update(segment_counts)
+    return dict(counter.most_common(top_n))
+
+# 布局引擎注册表：名称 -> 布局函数（输入 WordCloud 对象和词频，完成布局后返回该对象）
+LAYOUT_ENGINES = {}
+
+def register_layout_engine(name):
+    """注册布局引擎，布局结果需与 WordCloud.generate_from_frequencies 相同，写入 layout_ 和 words_"""
+    def decorator(func):
+        LAYOUT_ENGINES[name] = func
+        return func
+    return decorator
+
+@register_layout_engine('wordcloud')
+def wordcloud_layout(wordcloud, frequencies):
+    """WordCloud 自带的布局：每个字号逐一尝试，每放置一个词语重新计算右下方的整块积分图"""
+    return wordcloud.generate_from_frequencies(frequencies)
+
+def _window_free(integral, height, width):
+    """积分图（首行首列为0）中 height×width 窗口内没有占用像素的位置，下标为窗口左上角"""
+    rows, cols = integral.shape[0] - height, integral.shape[1] - width
+    area = integral[height:, width:] - integral[:rows, width:]
+    area -= integral[height:, :cols]
+    area += integral[:rows, :cols]
+    return area == 0
+
+def _add_to_integral(integral, delta, top, left):
+    """把 delta 区域（左上角为 top, left）新增的占用累加到积分图，只做加法，不重新计算累加和"""
+    partial = delta.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+    bottom, right = top + delta.shape[0], left + delta.shape[1]
+    integral[top + 1:bottom + 1, left + 1:right + 1] += partial
+    integral[top + 1:bottom + 1, right + 1:] += partial[:, -1:]
+    integral[bottom + 1:, left + 1:right + 1] += partial[-1]
+    integral[bottom + 1:, right + 1:] += partial[-1, -1]
+
+class OccupancyMap:
+    """加速布局使用的占用图金字塔：像素级积分图 + 按 LAYOUT_PYRAMID_BLOCKS 分块的粗粒度积分图
+
+    粗粒度的块只要包含一个占用像素就算占用。查找位置时由粗到细：先找完全空闲的连续块（找到即可放置），
+    再用最细一级的分块排除放不下的位置，只在剩下的候选位置上查询像素级积分图
+    """
+
+    def __init__(self, blocked, blocks=LAYOUT_PYRAMID_BLOCKS):
+        self.height, self.width = blocked.shape
+        largest = max(blocks)
+        # 补齐到最大块的整数倍，补齐的部分视为占用
+        self.blocked = np.ones((-(-self.height // largest) * largest, -(-self.width // largest) * largest), dtype=bool)
+        self.blocked[:self.height, :self.width] = blocked
+        self.integral = self._integral(blocked)
+        # 各级分块由粗到细：(块边长, 块是否占用, 积分图)
+        self.levels = []
+        for block in sorted(blocks, reverse=True):
+            coarse = self._coarse_blocks(block, 0, 0, self.blocked.shape[0] // block, self.blocked.shape[1] // block)
+            self.levels.append((block, coarse, self._integral(coarse)))
+
+    @staticmethod
+    def _integral(blocked):
+        """首行首列为0的积分图"""
+        integral = np.zeros((blocked.shape[0] + 1, blocked.shape[1] + 1), dtype=np.int32)
+        integral[1:, 1:] = blocked.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+        return integral
+
+    def _coarse_blocks(self, block, top, left, bottom, right):
+        """按块统计 [top, bottom) × [left, right) 范围内（以块为单位）的块是否包含占用像素"""
+        pixels = self.blocked[top * block:bottom * block, left * block:right * block]
+        return pixels.reshape(bottom - top, block, right - left, block).any(axis=(1, 3))
+
+    def sample_position(self, height, width, random_state):
+        """随机返回一个能放下 height×width 方框的左上角 (行, 列)，放不下时返回None"""
+        if height > self.height or width > self.width:
+            return None
+        
+        # 由粗到细：完全空闲的连续块一定能放下
+        for block, coarse, integral in self.levels:
+            rows, cols = -(-height // block), -(-width // block)
+            if rows > coarse.shape[0] or cols > coarse.shape[1]:
+                continue
+            free = np.flatnonzero(_window_free(integral, rows, cols))
+            if free.size:
+                row, col = divmod(int(free[random_state.randrange(free.size)]), coarse.shape[1] - cols + 1)
+                # 在空闲块内随机偏移，避免词语都对齐到块的边界
+                return (row * block + random_state.randrange(rows * block - height + 1),
+                        col * block + random_state.randrange(cols * block - width + 1))
+        
+        # 能放下的方框至少完整覆盖 inner_rows × inner_cols 个块，这些块必须全部空闲；
+        # 方框左上角 (x, y) 对应的第一个完整块为 (ceil(x / block), ceil(y / block))，据此反推候选位置
+        block, coarse, integral = self.levels[-1]
+        inner_rows, inner_cols = (height - block + 1) // block, (width - block + 1) // block
+        if inner_rows > 0 and inner_cols > 0:
+            candidates = np.flatnonzero(_window_free(integral, inner_rows, inner_cols))
+            if not candidates.size:
+                return None
+            if candidates.size * block * block * 4 < self.height * self.width:
+                cell_rows, cell_cols = np.divmod(candidates, coarse.shape[1] - inner_cols + 1)
+                offsets = np.arange(block)
+                xs = (cell_rows[:, None, None] * block - offsets[None, :, None]).repeat(block, axis=2).ravel()
+                ys = (cell_cols[:, None, None] * block - offsets[None, None, :]).repeat(block, axis=1).ravel()
+                valid = (xs >= 0) & (ys >= 0) & (xs <= self.height - height) & (ys <= self.width - width)
+                xs, ys = xs[valid], ys[valid]
+                integral = self.integral
+                area = integral[xs + height, ys + width] - integral[xs, ys + width]
+                area -= integral[xs + height, ys]
+                area += integral[xs, ys]
+                free = np.flatnonzero(area == 0)
+                if not free.size:
+                    return None
+                index = free[random_state.randrange(free.size)]
+                return int(xs[index]), int(ys[index])
+        
+        # 像素级积分图
+        free = np.flatnonzero(_window_free(self.integral, height, width))
+        if not free.size:
+            return None
+        return divmod(int(free[random_state.randrange(free.size)]), self.width - width + 1)
+
+    def add(self, pixels, top, left):
+        """标记左上角为 (top, left) 的区域中新占用的像素，只更新各级积分图中受影响的区域"""
+        bottom, right = top + pixels.shape[0], left + pixels.shape[1]
+        region = self.blocked[top:bottom, left:right]
+        delta = pixels & ~region
+        if not delta.any():
+            return
+        region |= delta
+        _add_to_integral(self.integral, delta, top, left)
+        
+        for block, coarse, integral in self.levels:
+            coarse_top, coarse_left = top // block, left // block
+            coarse_bottom, coarse_right = -(-bottom // block), -(-right // block)
+            blocks = self._coarse_blocks(block, coarse_top, coarse_left, coarse_bottom, coarse_right)
+            coarse_region = coarse[coarse_top:coarse_bottom, coarse_left:coarse_right]
+            coarse_delta = blocks & ~coarse_region
+            if coarse_delta.any():
+                coarse_region |= coarse_delta
+                _add_to_integral(integral, coarse_delta, coarse_top, coarse_left)
+
+@register_layout_engine('fast')
+def fast_layout(wordcloud, frequencies, max_font_size=None):
+    """加速布局：结果格式与 WordCloud.generate_from_frequencies 相同（layout_、words_），绘制和输出不变
+
+    - 放置词语后只把新占用的像素累加到积分图，不重新计算整块区域
+    - 先在粗粒度分块占用图上查找位置和排除放不下的尺寸（见 OccupancyMap）
+    - 词语放不下时与 WordCloud 相同，先换方向再逐级减小字号，放下的词语数量与默认引擎相当
+    """
+    from PIL import ImageDraw, ImageFont
     
-    # 创建形状掩码
-    mask = None
-    colors = None
+    frequencies = sorted(frequencies.items(), key=lambda item: item[1], reverse=True)
+    if not frequencies:
+        raise ValueError('没有可用于布局的词汇')
+    frequencies = frequencies[:wordcloud.max_words]
+    max_frequency = float(frequencies[0][1])
+    frequencies = [(word, freq / max_frequency) for word, freq in frequencies]
     
-    if shape == 'custom' and image_data:
-        # 使用上传的图片作为掩码
-        mask = create_mask_from_image(image_data, width, height)
-        
-        # 如果需要从图片中提取颜色
-        if use_image_colors:
-            colors = extract_colors_from_image(image_data)
-    elif shape == 'circle':
-        # 创建圆形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        radius = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离
-                dx = j - center_x
-                dy = i - center_y
-                distance = np.sqrt(dx**2 + dy**2)
-                
-                # 如果距离小于等于半径，则在圆内
-                if distance <= radius:
-                    mask[i, j] = True
-    elif shape == 'rectangle':
-        # 矩形不需要特殊掩码
-        mask = None
-    elif shape == 'triangle':
-        # 创建三角形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x = width // 2
+    random_state = wordcloud.random_state or random.Random()
+    
+    if wordcloud.mask is not None:
+        blocked = wordcloud.mask == 255
+        if blocked.ndim == 3:
+            blocked = blocked.all(axis=2)
+    else:
+        blocked = np.zeros((wordcloud.height, wordcloud.width), dtype=bool)
+    height, width = blocked.shape
+    occupancy = OccupancyMap(blocked)
+    
+    img_grey = Image.new('L', (width, height))
+    draw = ImageDraw.Draw(img_grey)
+    
+    if max_font_size is None:
+        max_font_size = wordcloud.max_font_size
+    if max_font_size is None:
+        # 与 WordCloud 相同：用前两个词语布局一次来确定最大字号
+        if len(frequencies) == 1:
+            font_size = wordcloud.height
+        else:
+            fast_layout(wordcloud, dict(frequencies[:2]), max_font_size=wordcloud.height)
+            sizes = [item[1] for item in wordcloud.layout_]
+            if not sizes:
+                raise ValueError('画布太小或掩码遮挡了全部区域，无法放置词语')
+            font_size = int(2 * sizes[0] * sizes[1] / (sizes[0] + sizes[1])) if len(sizes) > 1 else sizes[0]
+    else:
+        font_size = max_font_size
+    
+    wordcloud.words_ = dict(frequencies)
+    
+    if wordcloud.repeat and len(frequencies) < wordcloud.max_words:
+        times_extend = int(np.ceil(wordcloud.max_words / len(frequencies))) - 1
+        frequencies_org = list(frequencies)
+        downweight = frequencies[-1][1]
+        for i in range(times_extend):
+            frequencies.extend([(word, freq * downweight ** (i + 1)) for word, freq in frequencies_org])
+    
+    fonts = {}
+    margin = wordcloud.margin
+    
+    def try_place(word, size, orientation):
+        """在指定字号和方向下查找位置，返回 (位置, 变换后的字体) 或None"""
+        font = fonts.get(size)
+        if font is None:
+            font = fonts[size] = font_registry.get_font(wordcloud.font_path, size)
+        transposed_font = ImageFont.TransposedFont(font, orientation=orientation)
+        box_size = draw.textbbox((0, 0), word, font=transposed_font, anchor='lt')
+        position = occupancy.sample_position(box_size[3] + margin, box_size[2] + margin, random_state)
+        return (position, transposed_font) if position is not None else None
+    
+    font_sizes, positions, orientations, colors = [], [], [], []
+    last_freq = 1.
+    relative_scaling = wordcloud.relative_scaling
+    for word, freq in frequencies:
+        if freq == 0:
+            continue
+        if relative_scaling != 0:
+            font_size = int(round((relative_scaling * (freq / float(last_freq)) + (1 - relative_scaling)) * font_size))
         
-        for i in range(height):
-            # 计算当前行的高度比例（从顶部0到底部1）
-            height_ratio = i / height
-            
-            # 三角形宽度随高度线性增加
-            # 顶部宽度为0，底部宽度为width
-            width_at_row = int(width * height_ratio)
-            
-            # 计算当前行的起始和结束位置
-            start_x = center_x - width_at_row // 2
-            end_x = center_x + width_at_row // 2
-            
-            # 设置掩码
-            if width_at_row > 0:
-                mask[i, start_x:end_x] = True
-    elif shape == 'heart':
-        # 创建心形掩码 - 使用更准确的心形方程，并旋转180度（倒置）
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2 - height // 10  # 稍微上移心形
-        
-        for i in range(height):
-            for j in range(width):
-                # 转换为相对于中心的坐标
-                x = (j - center_x) / (width / 3)
-                y = (i - center_y) / (height / 3)
-                
-                # 使用更准确的心形方程，并旋转180度（倒置）
-                # 旋转180度相当于将y坐标取反
-                y = -y  # 旋转180度
-                heart = (x**2 + y**2 - 1)**3 - x**2 * y**3
-                
-                # 如果点在心形内
-                if heart <= 0:
-                    mask[i, j] = True
-    elif shape == 'star':
-        # 创建星形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        outer_radius = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离和角度
-                dx = j - center_x
-                dy = i - center_y
-                distance = np.sqrt(dx**2 + dy**2)
-                
-                # 计算角度
-                if distance > 0:
-                    angle = np.arctan2(dy, dx)
-                    # 将角度映射到0-2π范围
-                    if angle < 0:
-                        angle += 2 * np.pi
-                    
-                    # 五角星有10个顶点（5个外顶点，5个内顶点）
-                    # 每个顶点之间的角度是36度（π/5）
-                    # 计算当前角度在哪个扇区
-                    sector = int(angle / (np.pi / 5))
-                    sector_angle = angle - sector * (np.pi / 5)
-                    
-                    # 判断是外顶点还是内顶点
-                    if sector % 2 == 0:
-                        # 外顶点扇区，使用外半径
-                        max_radius = outer_radius
-                    else:
-                        # 内顶点扇区，使用内半径
-                        max_radius = outer_radius * 0.4
-                    
-                    # 线性插值计算当前角度的半径
-                    if sector % 2 == 0:
-                        # 从外顶点到内顶点
-                        radius_at_angle = outer_radius - (outer_radius * 0.6) * (sector_angle / (np.pi / 5))
-                    else:
-                        # 从内顶点到外顶点
-                        radius_at_angle = outer_radius * 0.4 + (outer_radius * 0.6) * (sector_angle / (np.pi / 5))
-                    
-                    if distance <= radius_at_angle:
-                        mask[i, j] = True
-    elif shape == 'hexagon':
-        # 创建六边形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        radius = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离
-                dx = j - center_x
-                dy = i - center_y
-                distance = np.sqrt(dx**2 + dy**2)
-                
-                # 计算角度
-                if distance > 0:
-                    angle = np.arctan2(dy, dx)
-                    if angle < 0:
-                        angle += 2 * np.pi
-                    
-                    # 六边形有6个顶点，每个顶点之间的角度是60度（π/3）
-                    # 计算当前角度在哪个扇区
-                    sector = int(angle / (np.pi / 3))
-                    sector_angle = angle - sector * (np.pi / 3)
-                    
-                    # 计算当前角度的半径
-                    # 六边形的半径在每个扇区内是变化的
-                    if sector % 2 == 0:
-                        # 偶数扇区，使用完整半径
-                        radius_at_angle = radius
-                    else:
-                        # 奇数扇区，使用缩小的半径
-                        radius_at_angle = radius * 0.866  # cos(30°) ≈ 0.866
-                    
-                    if distance <= radius_at_angle:
-                        mask[i, j] = True
-    elif shape == 'ellipse':
-        # 创建椭圆形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        
-        # 椭圆的半长轴和半短轴
-        a = width // 2 - 10  # x轴半长轴
-        b = height // 2 - 10  # y轴半短轴
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离
-                dx = j - center_x
-                dy = i - center_y
-                
-                # 椭圆方程：(x/a)^2 + (y/b)^2 <= 1
-                if (dx**2 / a**2) + (dy**2 / b**2) <= 1:
-                    mask[i, j] = True
-    elif shape == 'diamond':
-        # 创建菱形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        size = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离
-                dx = abs(j - center_x)
-                dy = abs(i - center_y)
-                
-                # 菱形方程：|x|/a + |y|/b <= 1
-                if (dx / size) + (dy / size) <= 1:
-                    mask[i, j] = True
-    elif shape == 'pentagon':
-        # 创建五边形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        radius = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离和角度
-                dx = j - center_x
-                dy = i - center_y
-                distance = np.sqrt(dx**2 + dy**2)
-                
-                # 计算角度
-                if distance > 0:
-                    angle = np.arctan2(dy, dx)
-                    if angle < 0:
-                        angle += 2 * np.pi
-                    
-                    # 五边形有5个顶点，每个顶点之间的角度是72度（2π/5）
-                    # 计算当前角度在哪个扇区
-                    sector = int(angle / (2 * np.pi / 5))
-                    sector_angle = angle - sector * (2 * np.pi / 5)
-                    
-                    # 计算当前角度的半径
-                    # 五边形的半径在每个扇区内是变化的
-                    if sector % 2 == 0:
-                        # 偶数扇区，使用完整半径
-                        radius_at_angle = radius
-                    else:
-                        # 奇数扇区，使用缩小的半径
-                        radius_at_angle = radius * 0.7265  # cos(36°) ≈ 0.7265
-                    
-                    if distance <= radius_at_angle:
-                        mask[i, j] = True
-    elif shape == 'octagon':
-        # 创建八边形掩码
-        mask = np.zeros((height, width), dtype=bool)
-        center_x, center_y = width // 2, height // 2
-        radius = min(width, height) // 2 - 10
-        
-        for i in range(height):
-            for j in range(width):
-                # 计算到中心的距离和角度
-                dx = j - center_x
-                dy = i - center_y
-                distance = np.sqrt(dx**2 + dy**2)
-                
-                # 计算角度
-                if distance > 0:
-                    angle = np.arctan2(dy, dx)
-                    if angle < 0:
-                        angle += 2 * np.pi
-                    
-                    # 八边形有8个顶点，每个顶点之间的角度是45度（π/4）
-                    # 计算当前角度在哪个扇区
-                    sector = int(angle / (np.pi / 4))
-                    sector_angle = angle - sector * (np.pi / 4)
-                    
-                    # 计算当前角度的半径
-                    # 八边形的半径在每个扇区内是变化的
-                    if sector % 2 == 0:
-                        # 偶数扇区，使用完整半径
-                        radius_at_angle = radius
-                    else:
-                        # 奇数扇区，使用缩小的半径
-                        radius_at_angle = radius * 0.7071  # cos(45°) ≈ 0.7071
-                    
-                    if distance <= radius_at_angle:
-                        mask[i, j] = True
-    elif shape == 'china_map':
-        # 使用chinamap.jpg作为中国地图模板
-        try:
-            # 加载中国地图图片
-            china_map_path = os.path.join(os.path.dirname(__file__), 'chinamap.jpg')
-            china_map_img = Image.open(china_map_path)
-            
-            # 计算保持纵横比的缩放尺寸
-            img_width, img_height = china_map_img.size
-            aspect_ratio = img_width / img_height
-            
-            # 根据请求的尺寸和图片纵横比计算实际尺寸
-            if width / height > aspect_ratio:
-                # 请求的宽度相对于高度太大，以高度为准
-                new_height = height
-                new_width = int(height * aspect_ratio)
+        # 与 WordCloud 相同：先按随机选择的方向尝试，放不下时换一个方向，再逐级减小字号（横排）
+        orientation = None if random_state.random() < wordcloud.prefer_horizontal else Image.ROTATE_90
+        tried_other_orientation = False
+        found = None
+        while font_size >= wordcloud.min_font_size:
+            found = try_place(word, font_size, orientation)
+            if found is not None:
+                break
+            if not tried_other_orientation and wordcloud.prefer_horizontal < 1:
+                orientation = Image.ROTATE_90 if orientation is None else None
+                tried_other_orientation = True
             else:
-                # 请求的高度相对于宽度太大，以宽度为准
-                new_width = width
-                new_height = int(width / aspect_ratio)
-            
-            # 调整图片大小，保持纵横比
-            china_map_img = china_map_img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # 将图片转换为灰度图像作为掩码
-            china_map_gray = china_map_img.convert('L')
-            
-            # 创建一个与请求尺寸相同的空白掩码
-            mask = np.zeros((height, width), dtype=bool)
-            
-            # 将缩放后的地图居中放置在掩码中
-            offset_x = (width - new_width) // 2
-            offset_y = (height - new_height) // 2
-            
-            # 将图片数据转换为numpy数组并设置掩码
-            china_map_array = np.array(china_map_gray)
-            
-            # 将地图图像复制到掩码的中心位置
-            mask[offset_y:offset_y+new_height, offset_x:offset_x+new_width] = china_map_array < 128
-            
-        except Exception as e:
-            print(f"加载中国地图模板失败: {e}")
-            # 如果加载失败，使用简单的矩形作为后备
-            mask = np.zeros((height, width), dtype=bool)
-            mask[height//4:3*height//4, width//4:3*width//4] = True
-    elif shape == 'shanghai_map':
-        # 使用shanghai.jpg作为上海地图模板
-        try:
-            # 加载上海地图图片
-            shanghai_map_path = os.path.join(os.path.dirname(__file__), 'shanghai.png')
-            shanghai_map_img = Image.open(shanghai_map_path)
-            
-            # 计算保持纵横比的缩放尺寸
-            img_width, img_height = shanghai_map_img.size
-            aspect_ratio = img_width / img_height
-            
-            # 根据请求的尺寸和图片纵横比计算实际尺寸
-            if width / height > aspect_ratio:
-                # 请求的宽度相对于高度太大，以高度为准
-                new_height = height
-                new_width = int(height * aspect_ratio)
-            else:
-                # 请求的高度相对于宽度太大，以宽度为准
-                new_width = width
-                new_height = int(width / aspect_ratio)
-            
-            # 调整图片大小，保持纵横比
-            shanghai_map_img = shanghai_map_img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # 将图片转换为灰度图像作为掩码
-            shanghai_map_gray = shanghai_map_img.convert('L')
-            
-            # 创建一个与请求尺寸相同的空白掩码
-            mask = np.zeros((height, width), dtype=bool)
-            
-            # 将缩放后的地图居中放置在掩码中
-            offset_x = (width - new_width) // 2
-            offset_y = (height - new_height) // 2
-            
-            # 将图片数据转换为numpy数组并设置掩码
-            shanghai_map_array = np.array(shanghai_map_gray)
-            
-            # 将地图图像复制到掩码的中心位置
-            # 反转逻辑：较亮的区域(大于阈值)设为True(形状内)，较暗的区域设为False(形状外)
-            mask[offset_y:offset_y+new_height, offset_x:offset_x+new_width] = shanghai_map_array > 128
-            
-        except Exception as e:
-            print(f"加载上海地图模板失败: {e}")
-            # 如果加载失败，使用简单的矩形作为后备
-            mask = np.zeros((height, width), dtype=bool)
-            mask[height//4:3*height//4, width//4:3*width//4] = True
-    
-    # 创建词云对象
-    # 将布尔掩码转换为整数掩码（0和255）
-    # WordCloud中，白色区域(255)是词云可以填充的区域，黑色区域(0)是词云不能填充的区域
-    if mask is not None:
-        # 对于上海地图，直接使用布尔掩码，不需要反转
-        if shape == 'shanghai_map':
-            mask = mask.astype(np.uint8) * 255
+                font_size -= wordcloud.font_step
+                orientation = None
+        if found is None:
+            # 最小字号也放不下，停止布局
+            break
+        
+        (x, y), transposed_font = found
+        x, y = x + margin // 2, y + margin // 2
+        draw.text((y, x), word, fill='white', font=transposed_font)
+        # 只取出本次绘制的区域更新占用图
+        left, top, right, bottom = draw.textbbox((y, x), word, font=transposed_font)
+        left, top = max(0, int(left)), max(0, int(top))
+        right, bottom = min(width, int(math.ceil(right))), min(height, int(math.ceil(bottom)))
+        if right > left and bottom > top:
+            occupancy.add(np.asarray(img_grey.crop((left, top, right, bottom))) > 0, top, left)
+        
+        positions.append((x, y))
+        orientations.append(orientation)
+        font_sizes.append(font_size)
+        colors.append(wordcloud.color_func(word, font_size=font_size, position=(x, y),
+                                           orientation=orientation, random_state=random_state,
+                                           font_path=wordcloud.font_path))
+        last_freq = freq
+    
+    wordcloud.layout_ = list(zip(frequencies, font_sizes, positions, orientations, colors))
+    return wordcloud
+
+def create_wordcloud(text, shape='circle', width=800, height=400, background_color='white', image_data=None, use_image_colors=False, font_name='default', color_theme='viridis', timings=None,
+                     input_mode='list', segmenter=None, stopwords=None, frequencies=None,
+                     max_words=DEFAULT_MAX_WORDS, relative_scaling=DEFAULT_RELATIVE_SCALING,
+                     layout_engine=DEFAULT_LAYOUT_ENGINE, seed=LAYOUT_SEED):
+    """创建词云图，timings 不为None时记录各阶段耗时
+
+    input_mode 为 document 时 text 可以是文本文件对象，按块读取并统计词频；
+    给出 frequencies（{词语: 权重}）时直接使用，不再解析 text；
+    layout_engine 为 LAYOUT_ENGINES 中的布局引擎名称，seed 为布局的随机种子；
+    图片形状提取的颜色记录在返回对象的 image_colors_ 中，供重新着色使用
+    """
+    with stage(timings, 'parse'):
+        if frequencies is not None:
+            word_freq = frequencies
+        elif input_mode == 'document':
+            word_freq = count_word_frequencies(text, segmenter, stopwords, max_words)
         else:
-            # 对于其他形状，反转掩码：True(形状内) -> 255(白色)，False(形状外) -> 0(黑色)
-            mask = (~mask).astype(np.uint8) * 255
+            word_freq = parse_word_list(text)
+    
+    if not word_freq:
+        raise InputError('没有可用于生成词云的词汇')
+    
+    # 创建形状掩码
+    image_colors = None
+
+    if shape == 'custom' and image_data:
+        with stage(timings, 'mask'):
+            # 上传的图片只解码一次，掩码和颜色提取共用
+            upload = decode_upload(image_data, (width, height))
+            
+            # 使用上传的图片作为掩码
+            mask = shape_mask_to_wordcloud(create_mask_from_image(upload.image, width, height))
+        
+        # 提取图片颜色（按图片摘要缓存），不使用图片颜色时也记录下来供重新着色
+        with stage(timings, 'palette'):
+            image_colors = extract_colors_from_image(upload)
+    else:
+        with stage(timings, 'mask'):
+            mask = get_shape_mask(shape, width, height)
+        
+        # 模板库中的模板使用上传时提取的颜色
+        if template_library.exists(shape):
+            image_colors = template_library.colors(shape)
+    
+    # 地图和图片形状只在掩码的有效区域内布局，空白边距不参与布局和积分图计算
+    bbox = None
+    if shape in MASK_BBOX_SHAPES or shape == 'custom' or shape.startswith(TEMPLATE_ID_PREFIX):
+        with stage(timings, 'mask'):
+            bbox = mask_bbox(mask)
+        if bbox is not None:
+            top, bottom, left, right = bbox
+            mask = mask[top:bottom + 1, left:right + 1]
     
     # 设置颜色方案
-    colormap = None
-    if colors:
-        # 如果有从图片提取的颜色，创建自定义颜色映射
-        colormap = plt.matplotlib.colors.ListedColormap(colors)
-    elif color_theme in COLOR_THEMES:
-        # 使用预定义的颜色主题
-        colormap = color_theme
+    colormap = get_colormap(color_theme, image_colors if use_image_colors else None)
     
     # 获取字体路径
     font_path = get_font_by_name(font_name)
     if not font_path:
         print("警告：未找到合适的中文字体，可能影响中文显示")
     
-    wordcloud = WordCloud(
-        width=width,
-        height=height,
-        background_color=background_color,
-        mask=mask,
-        font_path=font_path,
-        max_words=100,
-        relative_scaling=0.5,
-        colormap=colormap if colormap else 'viridis',
-        color_func=None if colors else None
-    ).generate_from_frequencies(word_freq)
+    WordCloud = load_wordcloud_class()
+    with stage(timings, 'layout'):
+        wordcloud = WordCloud(
+            width=width,
+            height=height,
+            background_color=background_color,
+            mask=mask,
+            font_path=font_path,
+            max_words=max_words,
+            relative_scaling=relative_scaling,
+            random_state=seed,
+            colormap=colormap
+        )
+        wordcloud = LAYOUT_ENGINES[layout_engine](wordcloud, word_freq)
+    wordcloud.image_colors_ = image_colors
+    
+    # 地图输出裁剪到有效区域的图片；其他形状把词语位置换算回完整画布，输出请求的尺寸
+    if bbox is not None and shape not in MASK_BBOX_SHAPES:
+        wordcloud.layout_ = [
+            (word, font_size, (y + top, x + left), orientation, color)
+            for word, font_size, (y, x), orientation, color in wordcloud.layout_
+        ]
+        wordcloud.mask = None
+        wordcloud.width, wordcloud.height = width, height
     
     return wordcloud
 
+def get_colormap(color_theme, colors=None):
+    """词语的颜色映射：有图片颜色时使用图片颜色，否则使用预定义的颜色主题（未知主题使用 viridis）"""
+    if not colors:
+        colors = CUSTOM_COLOR_THEMES.get(color_theme)
+    if colors:
+        from matplotlib.colors import ListedColormap
+        return ListedColormap(colors)
+    return color_theme if color_theme in COLOR_THEMES else 'viridis'
+
+def mask_bbox(mask):
+    """掩码中可以放置词语的区域（值不为255）的外接矩形 (top, bottom, left, right)，没有可用区域时返回None"""
+    usable = mask != 255
+    if usable.ndim == 3:
+        usable = usable.any(axis=2)
+    rows = np.flatnonzero(usable.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(usable.any(axis=0))
+    return rows[0], rows[-1], cols[0], cols[-1]
+
+def canvas_size(wordcloud):
+    """词云画布的尺寸 (宽, 高)：有掩码时为掩码的尺寸"""
+    if wordcloud.mask is not None:
+        return wordcloud.mask.shape[1], wordcloud.mask.shape[0]
+    return wordcloud.width, wordcloud.height
+
+def encode_image(img, output_format='png', quality=None, compress_level=None):
+    """将PIL图像编码为指定格式，返回 (图片字节, MIME类型)"""
+    pil_format, mime_type, _ = OUTPUT_FORMATS[output_format]
+    save_kwargs = {}
+    if output_format == 'png':
+        level = PNG_COMPRESS_LEVEL if compress_level is None else int(compress_level)
+        save_kwargs['compress_level'] = min(max(level, 0), 9)
+    else:
+        default_quality = JPEG_QUALITY if output_format == 'jpeg' else WEBP_QUALITY
+        level = default_quality if quality is None else int(quality)
+        save_kwargs['quality'] = min(max(level, 1), 100)
+        if img.mode not in ('RGB', 'L') and output_format == 'jpeg':
+            # JPEG不支持透明通道
+            img = img.convert('RGB')
+    
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format=pil_format, **save_kwargs)
+    return img_buffer.getvalue(), mime_type
+
+def _subset_font(font_path, characters):
+    """用 fontTools 把字体裁剪为只包含 characters 的子集，返回 (字体字节, 格式)"""
+    from fontTools import subset
+    options = subset.Options(
+        hinting=False,              # 去掉微调指令，对字形影响很小，体积小很多
+        desubroutinize=True,
+        ignore_missing_glyphs=True
+    )
+    options.font_number = 0         # .ttc 字体集合使用第一个字体（与 PIL 的默认值相同）
+    options.drop_tables += ['FFTM']  # FontForge 时间戳，fontTools 无法裁剪
+    options.flavor = SVG_FONT_FLAVOR
+    font = subset.load_font(font_path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=characters)
+    subsetter.subset(font)
+    buffer = io.BytesIO()
+    subset.save_font(font, buffer, options)
+    return buffer.getvalue(), SVG_FONT_FLAVOR
+
+font_subset_cache = LRUCache(FONT_SUBSET_CACHE_MAX_ENTRIES, FONT_SUBSET_CACHE_MAX_BYTES,
+                             sizeof=lambda subset: len(subset[0]))
+
+def subset_font(font_path, text):
+    """只包含 text 中字符的字体子集（按字体和字符集合缓存），返回 (字体字节, 格式)；未安装 fontTools 时返回None"""
+    if importlib.util.find_spec('fontTools') is None:
+        print("警告：未安装fontTools，SVG中不嵌入字体")
+        return None
+    characters = ''.join(sorted(set(text)))
+    return font_subset_cache.get((font_path, characters), lambda: _subset_font(font_path, characters))
+
+def render_svg(wordcloud, size=None):
+    """把词云导出为SVG文本，内嵌只包含所用字符的字体子集；带 viewBox，可以在客户端任意缩放
+
+    词语位置的计算方式与 WordCloud.to_svg 相同，size 为 (宽, 高) 时使用该尺寸
+    """
+    from xml.sax.saxutils import escape
+    
+    scale = wordcloud.scale
+    if size is None:
+        canvas_width, canvas_height = canvas_size(wordcloud)
+        size = (round(canvas_width * scale), round(canvas_height * scale))
+    width, height = size
+    
+    family, font_style = font_registry.get_font(wordcloud.font_path, 12).getname()
+    font_style = font_style.lower()
+    weight = 'bold' if 'bold' in font_style else 'normal'
+    style = 'italic' if 'italic' in font_style else 'oblique' if 'oblique' in font_style else 'normal'
+    font_css = f'font-family:{json.dumps(family)};font-weight:{weight};font-style:{style}'
+    
+    result = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">']
+    css = f'text{{{font_css}}}'
+    subset = subset_font(wordcloud.font_path, ''.join(item[0][0] for item in wordcloud.layout_))
+    if subset is not None:
+        font_bytes, font_format = subset
+        css = (f'@font-face{{{font_css};src:url(data:font/{font_format};base64,'
+               f'{base64.b64encode(font_bytes).decode()}) format("{font_format}")}}' + css)
+    result.append(f'<style>{escape(css)}</style>')
+    if wordcloud.background_color is not None:
+        result.append(f'<rect width="100%" height="100%" fill="{escape(str(wordcloud.background_color))}"/>')
+    
+    fonts = {}
+    for (word, _), font_size, (y, x), orientation, color in wordcloud.layout_:
+        pixel_size = int(font_size * scale)
+        font = fonts.get(pixel_size)
+        if font is None:
+            font = fonts[pixel_size] = font_registry.get_font(wordcloud.font_path, pixel_size)
+        (size_x, _), (offset_x, offset_y) = font.font.getsize(word)
+        ascent, _ = font.getmetrics()
+        x, y = x * scale, y * scale
+        min_x, max_x, max_y = -offset_x, size_x - offset_x, ascent - offset_y
+        if orientation == Image.ROTATE_90:
+            transform = f'translate({x + max_y:g},{y + max_x - min_x:g}) rotate(-90)'
+        else:
+            transform = f'translate({x + min_x:g},{y + max_y:g})'
+        result.append(f'<text transform="{transform}" font-size="{font_size * scale:g}" fill="{color}">{escape(word)}</text>')
+    result.append('</svg>')
+    return '\n'.join(result)
+
+def _render_with_matplotlib(wordcloud, background_color):
+    """使用matplotlib重新绘制词云并保存为PNG（旧的渲染路径）"""
+    plt = load_pyplot()
+    img_buffer = io.BytesIO()
+    
+    # 创建词云图像，图形尺寸与词云画布一致（地图形状已在布局时裁剪到有效区域）
+    wordcloud_array = wordcloud.to_array()
+    height, width = wordcloud_array.shape[:2]
+    fig = plt.figure(figsize=(width/100, height/100), dpi=100)
+    ax = fig.add_subplot(111)
+    ax.imshow(wordcloud_array, interpolation='bilinear')
+    ax.axis('off')
+    
+    # 调整布局
+    plt.subplots_adjust(left=0, right=1, top=1, bottom=0, wspace=0, hspace=0)
+    
+    # 保存图像到缓冲区
+    fig.savefig(img_buffer, format='png', bbox_inches='tight', 
+               facecolor=background_color, edgecolor='none', dpi=100)
+    
+    # 关闭图形，释放内存
+    plt.close(fig)
+    return img_buffer.getvalue()
+
+def render_wordcloud(wordcloud, background_color, output_format='png', renderer='direct',
+                     quality=None, compress_level=None, timings=None, size=None):
+    """将词云渲染为图片字节，返回 (图片字节, MIME类型)
+
+    renderer 为 'direct' 时直接使用 WordCloud.to_image() 编码；
+    为 'matplotlib' 时使用旧的 matplotlib 重绘路径（仅输出PNG）。
+    size 为 (宽, 高) 时把绘制结果裁剪或补齐到该尺寸；svg 格式总是由 render_svg 直接生成
+    """
+    if output_format == 'svg':
+        with stage(timings, 'svg'):
+            return render_svg(wordcloud, size).encode('utf-8'), OUTPUT_FORMATS['svg'][1]
+    
+    if renderer == 'matplotlib':
+        with stage(timings, 'matplotlib'):
+            return _render_with_matplotlib(wordcloud, background_color), 'image/png'
+    
+    with stage(timings, 'draw'):
+        img = wordcloud.to_image()
+        
+        # 放大绘制预览布局时，取整可能使图片比目标尺寸多出一两个像素，裁到目标尺寸
+        if size is not None and img.size != tuple(size):
+            width, height = size
+            canvas = Image.new(img.mode, (width, height), background_color)
+            canvas.paste(img.crop((0, 0, min(width, img.width), min(height, img.height))))
+            img = canvas
+    
+    with stage(timings, 'encode'):
+        return encode_image(img, output_format, quality=quality, compress_level=compress_level)
+
+def _result_nbytes(result):
+    return len(result[0])
+
+result_store = LRUCache(RESULT_STORE_MAX_ENTRIES, RESULT_STORE_MAX_BYTES, sizeof=_result_nbytes)
+
+def store_result(image_bytes, mime_type):
+    """保存渲染结果，返回按内容计算的结果ID（同时用作ETag）"""
+    result_id = hashlib.sha256(image_bytes).hexdigest()[:32]
+    result_store.put(result_id, (image_bytes, mime_type))
+    return result_id
+
+def render_cache_key(params):
+    """根据全部渲染参数计算规范化的缓存键（图片数据使用摘要代替原文）"""
+    canonical = dict(params)
+    image_data = canonical.pop('image_data', None)
+    canonical['image_digest'] = hashlib.sha256(image_data.encode()).hexdigest() if image_data else None
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """两级渲染结果缓存：内存LRU + 可选的磁盘缓存
+
+    缓存值为 (图片字节, MIME类型, 结果ID)，磁盘文件名为 <缓存键>.<扩展名>
+    """
+
+    def __init__(self, max_entries=RENDER_CACHE_MAX_ENTRIES, max_bytes=RENDER_CACHE_MAX_BYTES,
+                 disk_dir=None, disk_max_bytes=RENDER_CACHE_DISK_MAX_BYTES):
+        self.memory = LRUCache(max_entries, max_bytes, sizeof=_result_nbytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_paths(self, key):
+        for _, mime_type, extension in OUTPUT_FORMATS.values():
+            yield os.path.join(self.disk_dir, f'{key}.{extension}'), mime_type
+
+    def get(self, key):
+        """查找缓存结果，未命中时返回None"""
+        result = self.memory.lookup(key)
+        if result is not None:
+            return result
+        
+        if self.disk_dir:
+            for path, mime_type in self._disk_paths(key):
+                try:
+                    with open(path, 'rb') as f:
+                        image_bytes = f.read()
+                except OSError:
+                    continue
+                result = (image_bytes, mime_type, hashlib.sha256(image_bytes).hexdigest()[:32])
+                self.memory.put(key, result)
+                with self._lock:
+                    self.disk_hits += 1
+                return result
+        
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, image_bytes, mime_type, result_id):
+        """写入缓存（磁盘写入失败不影响请求）"""
+        self.memory.put(key, (image_bytes, mime_type, result_id))
+        if not self.disk_dir:
+            return
+        extension = next(ext for _, mime, ext in OUTPUT_FORMATS.values() if mime == mime_type)
+        path = os.path.join(self.disk_dir, f'{key}.{extension}')
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # 先写临时文件再重命名，避免并发读取到不完整的文件
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+        except OSError as e:
+            print(f"写入渲染缓存失败: {e}")
+
+    def _disk_files(self):
+        """返回磁盘缓存文件列表 [(修改时间, 大小, 路径)]"""
+        files = []
+        try:
+            entries = list(os.scandir(self.disk_dir))
+        except OSError:
+            return files
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _prune_disk(self):
+        """磁盘缓存超出上限时删除最旧的文件"""
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        """返回缓存统计信息"""
+        memory_stats = self.memory.stats()
+        with self._lock:
+            disk_hits, misses = self.disk_hits, self.misses
+        total = memory_stats['hits'] + disk_hits + misses
+        stats = {
+            'memory': memory_stats,
+            'disk_enabled': bool(self.disk_dir),
+            'disk_hits': disk_hits,
+            'misses': misses,
+            'hit_ratio': (memory_stats['hits'] + disk_hits) / total if total else 0.0
+        }
+        if self.disk_dir:
+            files = self._disk_files()
+            stats['disk_entries'] = len(files)
+            stats['disk_bytes'] = sum(size for _, size, _ in files)
+        return stats
+
+render_cache = RenderCache(
+    disk_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output', 'render_cache')
+    if RENDER_CACHE_DISK else None
+)
+
+def get_response_format(data):
+    """确定 /generate 的响应方式：请求参数优先，其次根据Accept头判断"""
+    response_format = data.get('format') or request.args.get('format')
+    if response_format:
+        return str(response_format).lower()
+    
+    image_types = [mime_type for _, mime_type, _ in OUTPUT_FORMATS.values()]
+    best = request.accept_mimetypes.best_match(['application/json'] + image_types)
+    return 'binary' if best in image_types else 'json'
+
+def image_response(image_bytes, mime_type, etag):
+    """构建带ETag的图片响应，客户端缓存有效时返回304
+
+    图片内容由ETag唯一确定，因此 POST /generate 也同样支持 If-None-Match
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(image_bytes, mimetype=mime_type)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = RESULT_MAX_AGE
+    return response
+
+def build_wordcloud(params, timings=None):
+    """根据渲染参数生成词云（完成布局，尚未绘制）"""
+    with contextlib.ExitStack() as stack:
+        # 命令行批量渲染可以用 text_file 指定文档，按块读取而不一次性载入
+        text = params['text']
+        if params.get('text_file'):
+            text = stack.enter_context(open(params['text_file'], 'r', encoding='utf-8', errors='replace'))
+        wordcloud = create_wordcloud(
+            text, params['shape'], params['width'], params['height'],
+            params['background_color'],
+            image_data=params.get('image_data'),
+            use_image_colors=params.get('use_image_colors', False),
+            font_name=params.get('font_name', 'default'),
+            color_theme=params.get('color_theme', 'viridis'),
+            timings=timings,
+            input_mode=params.get('input_mode', 'list'),
+            segmenter=params.get('segmenter'),
+            stopwords=params.get('stopwords'),
+            frequencies=params.get('frequencies'),
+            max_words=params.get('max_words', DEFAULT_MAX_WORDS),
+            relative_scaling=params.get('relative_scaling', DEFAULT_RELATIVE_SCALING),
+            layout_engine=params.get('layout_engine', DEFAULT_LAYOUT_ENGINE),
+            seed=params.get('seed', LAYOUT_SEED)
+        )
+    return wordcloud
+
+def render_with_layout(params, timings=None):
+    """根据渲染参数生成词云并编码，返回 (图片字节, MIME类型, 布局)；timings 不为None时记录各阶段耗时"""
+    wordcloud = build_wordcloud(params, timings)
+    
+    # 渲染并编码图片（默认直接由WordCloud输出，不经过matplotlib）
+    image_bytes, mime_type = render_wordcloud(
+        wordcloud, params['background_color'],
+        output_format=params.get('output_format', DEFAULT_OUTPUT_FORMAT),
+        renderer=params.get('renderer', 'direct'),
+        quality=params.get('quality'),
+        compress_level=params.get('compress_level'),
+        timings=timings
+    )
+    return image_bytes, mime_type, layout_record(wordcloud, params)
+
+def render_from_params(params, timings=None):
+    """根据渲染参数生成词云并编码，返回 (图片字节, MIME类型)；timings 不为None时记录各阶段耗时"""
+    image_bytes, mime_type, _ = render_with_layout(params, timings)
+    return image_bytes, mime_type
+
+def layout_record(wordcloud, params, size=None):
+    """可序列化的布局记录，交给 render_layout 按 size（默认为画布尺寸）重新绘制或重新着色，不需要重新布局"""
+    width, height = canvas_size(wordcloud)
+    return {
+        'layout': wordcloud.layout_,
+        'width': width,
+        'height': height,
+        'size': tuple(size) if size else (width, height),
+        'font_path': wordcloud.font_path,
+        'mode': wordcloud.mode,
+        'seed': params.get('seed', LAYOUT_SEED),
+        'image_colors': getattr(wordcloud, 'image_colors_', None)
+    }
+
+def layout_key(params):
+    """布局ID：由影响布局的参数计算，颜色和输出格式不同的请求共用同一个布局"""
+    layout_params = {name: value for name, value in params.items() if name not in RECOLOR_FIELDS + OUTPUT_FIELDS}
+    return render_cache_key(layout_params)[:32]
+
+def _layout_nbytes(layout):
+    # 每个词语的位置、字号、方向和颜色约占 200 字节
+    return len(layout['layout']) * 200
+
+layout_store = LRUCache(LAYOUT_STORE_MAX_ENTRIES, LAYOUT_STORE_MAX_BYTES, sizeof=_layout_nbytes)
+
+def preview_size(width, height):
+    """预览画布尺寸：长边不超过 PREVIEW_MAX_SIDE，返回 (宽, 高)"""
+    factor = max(1.0, max(width, height) / PREVIEW_MAX_SIDE)
+    return max(1, round(width / factor)), max(1, round(height / factor))
+
+def render_preview(params, timings=None):
+    """在缩小的画布上布局并绘制预览图（可在渲染进程中执行），返回 (预览图片字节, MIME类型, 布局)
+
+    布局的 size 为完整尺寸，交给 render_layout 放大绘制，不需要重新布局
+    """
+    width, height = preview_size(params['width'], params['height'])
+    preview_params = dict(params, width=width, height=height)
+    wordcloud = build_wordcloud(preview_params, timings)
+    image_bytes, mime_type = render_wordcloud(
+        wordcloud, params['background_color'],
+        output_format=params.get('output_format', DEFAULT_OUTPUT_FORMAT),
+        quality=params.get('quality'), compress_level=params.get('compress_level'),
+        timings=timings
+    )
+    
+    # 完整尺寸：画布与请求尺寸相同时输出请求的尺寸，地图形状的画布已裁剪到有效区域，按同样的比例放大
+    canvas_width, canvas_height = canvas_size(wordcloud)
+    if (canvas_width, canvas_height) == (width, height):
+        size = (params['width'], params['height'])
+    else:
+        scale = max(params['width'] / width, params['height'] / height)
+        size = (round(canvas_width * scale), round(canvas_height * scale))
+    return image_bytes, mime_type, layout_record(wordcloud, params, size)
+
+def render_layout(params, layout, recolor=False, timings=None):
+    """按布局的 size 绘制已有的布局并编码（可在渲染进程中执行），返回 (图片字节, MIME类型)
+
+    recolor 为 True 时按 params 中的颜色主题或图片颜色重新为词语着色，词语的位置和字号不变
+    """
+    WordCloud = load_wordcloud_class()
+    wordcloud = WordCloud(
+        width=layout['width'],
+        height=layout['height'],
+        background_color=params['background_color'],
+        font_path=layout['font_path'],
+        mode=layout['mode'],
+        # 取较大的放大倍数覆盖整个画布，多出的一两个像素在绘制后裁掉
+        scale=max(layout['size'][0] / layout['width'], layout['size'][1] / layout['height'])
+    )
+    wordcloud.layout_ = layout['layout']
+    if recolor:
+        with stage(timings, 'palette'):
+            colors = layout['image_colors'] if params.get('use_image_colors') else None
+            wordcloud.recolor(random_state=layout['seed'],
+                              colormap=get_colormap(params.get('color_theme', 'viridis'), colors))
+    return render_wordcloud(
+        wordcloud, params['background_color'],
+        output_format=params.get('output_format', DEFAULT_OUTPUT_FORMAT),
+        renderer=params.get('renderer', 'direct'),
+        quality=params.get('quality'),
+        compress_level=params.get('compress_level'),
+        timings=timings,
+        size=layout['size']
+    )
+
+def parse_encode_options(data, output_format, renderer):
+    """校验输出编码参数，返回 (quality, compress_level, 错误信息)"""
+    if renderer == 'matplotlib' and output_format != 'png':
+        return None, None, 'renderer=matplotlib 只支持 png 输出'
+    
+    options = []
+    for name in ('quality', 'compress_level'):
+        value = data.get(name)
+        if value is not None:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return None, None, f'{name} 必须是整数'
+        options.append(value)
+    return options[0], options[1], None
+
+def parse_background_color(data):
+    """校验背景色（PIL 支持的颜色字符串，null 表示透明背景），返回 (背景色, 错误信息)"""
+    background_color = data.get('background_color', 'white')
+    if background_color is None:
+        return None, None
+    if not isinstance(background_color, str):
+        return None, 'background_color 必须是颜色字符串'
+    from PIL import ImageColor
+    try:
+        ImageColor.getrgb(background_color)
+    except ValueError:
+        return None, f'无效的背景色: {background_color[:32]}'
+    return background_color, None
+
+def parse_render_params(data, allow_text_file=False):
+    """从请求数据中解析并校验渲染参数，返回 (参数, 错误信息)
+
+    allow_text_file 为 True 时（仅限命令行）允许用 text_file 指定本地文档
+    """
+    if not isinstance(data, dict):
+        return None, '请求体必须是JSON对象'
+    text = data.get('text', '')
+    text_file = data.get('text_file') if allow_text_file else None
+    # 已统计好的词频：JSON对象/数组，或CSV/TSV文本
+    frequencies, error = None, None
+    if data.get('frequencies') is not None:
+        frequencies, error = parse_frequencies(data['frequencies'])
+    elif data.get('frequencies_csv') is not None:
+        if not isinstance(data['frequencies_csv'], str):
+            return None, 'frequencies_csv 必须是文本'
+        frequencies, error = parse_frequency_table(data['frequencies_csv'])
+    if error:
+        return None, error
+    input_mode = data.get('input_mode', 'frequencies' if frequencies is not None else 'document' if text_file else 'list')
+    segmenter = data.get('segmenter') or default_segmenter()
+    stopwords = data.get('stopwords') or []
+    # template_id 指定模板库中的模板，与内置形状一样作为 shape 使用
+    shape = data.get('template_id') or data.get('shape', 'circle')
+    if not isinstance(shape, str):
+        return None, 'shape 必须是字符串'
+    try:
+        width = int(data.get('width', 800))
+        height = int(data.get('height', 400))
+    except (TypeError, ValueError):
+        return None, '宽度和高度必须是整数'
+    image_data = data.get('image_data', None)
+    if image_data is not None and not isinstance(image_data, str):
+        return None, 'image_data 必须是base64编码的图片文本'
+    output_format = str(data.get('output_format', DEFAULT_OUTPUT_FORMAT)).lower()
+    renderer = data.get('renderer', 'direct')
+    layout_engine = data.get('layout_engine') or DEFAULT_LAYOUT_ENGINE
+    
+    if input_mode not in INPUT_MODES:
+        return None, f'不支持的输入方式: {input_mode}'
+    
+    if input_mode == 'frequencies':
+        if not frequencies:
+            return None, '请提供词频 frequencies 或 frequencies_csv'
+    elif not isinstance(text, str) or not (text.strip() or text_file):
+        return None, '请输入词汇内容'
+    
+    if isinstance(text, str) and len(text) > MAX_TEXT_LENGTH:
+        return None, f'文本长度不能超过 {MAX_TEXT_LENGTH} 个字符'
+    
+    if input_mode == 'list' and text.count(',') >= MAX_LIST_WORDS:
+        return None, f'词汇数量不能超过 {MAX_LIST_WORDS} 个'
+    
+    try:
+        max_words = int(data.get('max_words', DEFAULT_MAX_WORDS))
+        relative_scaling = float(data.get('relative_scaling', DEFAULT_RELATIVE_SCALING))
+    except (TypeError, ValueError):
+        return None, 'max_words 和 relative_scaling 必须是数字'
+    if not 1 <= max_words <= MAX_WORDS_LIMIT:
+        return None, f'max_words 必须在 1 到 {MAX_WORDS_LIMIT} 之间'
+    if not 0 <= relative_scaling <= 1:
+        return None, 'relative_scaling 必须在 0 到 1 之间'
+    
+    if text_file and input_mode != 'document':
+        return None, 'text_file 只能用于 document 输入方式'
+    
+    if input_mode == 'document':
+        if segmenter not in available_segmenters():
+            return None, f'不支持的分词器: {segmenter}'
+        if not isinstance(stopwords, list) or not all(isinstance(word, str) for word in stopwords):
+            return None, 'stopwords 必须是字符串列表'
+        if len(stopwords) > DOCUMENT_MAX_STOPWORDS:
+            return None, f'停用词不能超过 {DOCUMENT_MAX_STOPWORDS} 个'
+    
+    if output_format not in OUTPUT_FORMATS:
+        return None, f'不支持的输出格式: {output_format}'
+    
+    if renderer not in ('direct', 'matplotlib'):
+        return None, f'不支持的渲染方式: {renderer}'
+    
+    quality, compress_level, error = parse_encode_options(data, output_format, renderer)
+    if error:
+        return None, error
+    
+    if layout_engine not in LAYOUT_ENGINES:
+        return None, f'不支持的布局引擎: {layout_engine}'
+    
+    color_theme = data.get('color_theme', 'viridis')
+    if not isinstance(color_theme, str) or color_theme not in COLOR_THEMES:
+        return None, f'不支持的颜色主题: {color_theme}'
+    
+    background_color, error = parse_background_color(data)
+    if error:
+        return None, error
+    
+    # 与宽高等参数一样用 int() 转换，命令行 CSV 参数文件中的值为字符串
+    seed = data.get('seed')
+    if seed is not None:
+        try:
+            if isinstance(seed, bool):
+                raise TypeError
+            seed = int(seed)
+        except (TypeError, ValueError):
+            return None, 'seed 必须是整数'
+    
+    # 如果选择了自定义图片但没有提供图片数据
+    if shape == 'custom' and not image_data:
+        return None, '请上传自定义图片模板'
+    
+    if shape.startswith(TEMPLATE_ID_PREFIX) and not template_library.exists(shape):
+        return None, f'模板不存在: {shape}'
+    
+    if image_data and len(image_data) * 3 // 4 > UPLOAD_MAX_BYTES:
+        return None, f'图片文件大小不能超过 {UPLOAD_MAX_BYTES // (1024 * 1024)}MB'
+    
+    # 使用用户输入的尺寸，默认为800x800
+    width = width if width > 0 else 800
+    height = height if height > 0 else 800
+    if max(width, height) > MAX_CANVAS_SIDE:
+        return None, f'宽度和高度不能超过 {MAX_CANVAS_SIDE} 像素'
+    if width * height > MAX_CANVAS_PIXELS:
+        return None, f'画布像素数不能超过 {MAX_CANVAS_PIXELS}（当前 {width}x{height}）'
+    
+    params = {
+        'text': text,
+        'shape': shape,
+        'width': width,
+        'height': height,
+        'background_color': background_color,
+        'image_data': image_data,
+        'use_image_colors': data.get('use_image_colors', False),
+        'font_name': data.get('font_name', 'default'),
+        'color_theme': color_theme,
+        'output_format': output_format,
+        'renderer': renderer,
+        'quality': quality,
+        'compress_level': compress_level,
+        'input_mode': input_mode,
+        'max_words': max_words,
+        'relative_scaling': relative_scaling
+    }
+    # 默认布局引擎不记录，保持已有的缓存键不变
+    if layout_engine != DEFAULT_LAYOUT_ENGINE:
+        params['layout_engine'] = layout_engine
+    if seed is not None:
+        params['seed'] = seed
+    if input_mode == 'frequencies':
+        # 词频模式不使用 text，清空以免影响缓存键
+        params['text'] = ''
+        params['frequencies'] = frequencies
+    # 分词器和停用词只影响文档模式，其他模式不记录
+    if input_mode == 'document':
+        params['segmenter'] = segmenter
+        params['stopwords'] = sorted(set(stopwords))
+        if text_file:
+            params['text_file'] = text_file
+    
+    # 在分配任何内存之前按预计占用拒绝过大的请求
+    estimate = estimate_render_memory(params)
+    if estimate > RENDER_MEMORY_MAX_PER_REQUEST:
+        return None, (f'预计内存占用 {estimate // (1024 * 1024)}MB 超过上限 '
+                      f'{RENDER_MEMORY_MAX_PER_REQUEST // (1024 * 1024)}MB，请减小画布尺寸')
+    return params, None
+
+def parse_recolor_params(data):
+    """从请求数据中解析并校验 /recolor 的参数，返回 (参数, 错误信息)"""
+    if not isinstance(data, dict):
+        return None, '请求体必须是JSON对象'
+    layout_id = data.get('layout_id')
+    if not isinstance(layout_id, str) or not layout_id:
+        return None, '请提供布局ID layout_id'
+    
+    output_format = str(data.get('output_format', DEFAULT_OUTPUT_FORMAT)).lower()
+    if output_format not in OUTPUT_FORMATS:
+        return None, f'不支持的输出格式: {output_format}'
+    
+    renderer = data.get('renderer', 'direct')
+    if renderer not in ('direct', 'matplotlib'):
+        return None, f'不支持的渲染方式: {renderer}'
+    
+    quality, compress_level, error = parse_encode_options(data, output_format, renderer)
+    if error:
+        return None, error
+    
+    color_theme = data.get('color_theme', 'viridis')
+    if not isinstance(color_theme, str) or color_theme not in COLOR_THEMES:
+        return None, f'不支持的颜色主题: {color_theme}'
+    
+    background_color, error = parse_background_color(data)
+    if error:
+        return None, error
+    
+    return {
+        'layout_id': layout_id,
+        'background_color': background_color,
+        'color_theme': color_theme,
+        'use_image_colors': bool(data.get('use_image_colors', False)),
+        'output_format': output_format,
+        'renderer': renderer,
+        'quality': quality,
+        'compress_level': compress_level
+    }, None
+
+def estimate_render_memory(params):
+    """估算一次渲染的峰值内存（字节），用于在分配之前拒绝或推迟渲染"""
+    pixels = params['width'] * params['height']
+    estimate = pixels * RENDER_BYTES_PER_PIXEL
+    if params.get('image_data'):
+        # 原始base64数据、解码后的图片（缩放到画布大小，按RGBA计）
+        estimate += len(params['image_data']) + pixels * 4
+    if params.get('renderer') == 'matplotlib':
+        # matplotlib 图形的RGBA缓冲和重采样
+        estimate += pixels * 16
+    if params.get('input_mode') == 'document':
+        # 分块读取的文本段和有上限的词频表
+        estimate += DOCUMENT_CHUNK_SIZE * 16 + DOCUMENT_COUNTER_CAPACITY * 2 * 200
+    return estimate
+
+# 指标直方图的分桶上限（秒）
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 画布尺寸分档（按像素数），避免每种尺寸都产生一组指标
+SIZE_BUCKETS = (('small', 400 * 400), ('medium', 1024 * 1024), ('large', 2048 * 2048))
+
+def size_bucket(width, height):
+    """画布尺寸所属的分档"""
+    pixels = width * height
+    for name, limit in SIZE_BUCKETS:
+        if pixels <= limit:
+            return name
+    return 'xlarge'
+
+def shape_label(shape):
+    """指标中的形状标签：模板库中的模板统一记为 template，其他未知形状记为 other，避免标签数量无限增长"""
+    if shape in SHAPE_TEMPLATES:
+        return shape
+    return 'template' if shape.startswith(TEMPLATE_ID_PREFIX) else 'other'
+
+def _format_labels(names, values, extra=None):
+    """格式化 Prometheus 标签，如 {shape="circle",size="small"}"""
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Histogram:
+    """Prometheus 格式的直方图，按标签值分别累计"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """记录一次观测值，labels 按 label_names 的顺序给出"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """输出 Prometheus 文本格式"""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, [("le", bound)])} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {count}')
+        return lines
+
+class Gauge:
+    """按标签值计数的当前值指标（如进行中的请求数）"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+    def render(self):
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            values = sorted(self._values.items())
+        return render_metric(self.name, self.help_text, 'gauge',
+                             [(_format_labels(self.label_names, labels), value) for labels, value in values])
+
+def render_metric(name, help_text, metric_type, samples):
+    """输出一个指标的 Prometheus 文本格式，samples 为 [(标签文本, 值)]"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+    return lines
+
+stage_histogram = Histogram('wordcloud_stage_seconds', '词云生成各阶段耗时', ('stage', 'shape', 'size'))
+render_histogram = Histogram('wordcloud_render_seconds', '未命中缓存时的渲染总耗时', ('shape', 'size'))
+request_histogram = Histogram('wordcloud_http_request_duration_seconds', 'HTTP请求耗时', ('endpoint', 'method', 'status'))
+requests_in_flight = Gauge('wordcloud_http_requests_in_flight', '正在处理的HTTP请求数', ('endpoint',))
+
+def observe_render(params, timings, elapsed):
+    """把一次渲染的各阶段耗时记录到直方图"""
+    shape = shape_label(params['shape'])
+    size = size_bucket(params['width'], params['height'])
+    for name, value in timings.items():
+        stage_histogram.observe(value, name, shape, size)
+    render_histogram.observe(elapsed, shape, size)
+
+def server_timing_header(timings):
+    """把各阶段耗时格式化为 Server-Timing 响应头"""
+    return ', '.join(f'{name};dur={value * 1000:.1f}' for name, value in timings.items())
+
+def cache_metrics():
+    """各缓存的命中统计，以 Prometheus 文本格式输出"""
+    caches = {
+        'mask': mask_cache.stats(),
+        'palette': palette_cache.stats(),
+        'font': font_registry.fonts.stats(),
+        'font_subset': font_subset_cache.stats(),
+        'result_store': result_store.stats(),
+        'layout_store': layout_store.stats(),
+        'render_memory': render_cache.memory.stats()
+    }
+    render_stats = render_cache.stats()
+    lines = []
+    for field, metric_type, help_text in (
+            ('hits', 'counter', '缓存命中次数'),
+            ('misses', 'counter', '缓存未命中次数'),
+            ('evictions', 'counter', '缓存淘汰次数'),
+            ('entries', 'gauge', '缓存条目数'),
+            ('bytes', 'gauge', '缓存占用字节数'),
+            ('hit_ratio', 'gauge', '缓存命中率')):
+        name = f'wordcloud_cache_{field}_total' if metric_type == 'counter' else f'wordcloud_cache_{field}'
+        lines.extend(render_metric(name, help_text, metric_type, [
+            (_format_labels(('cache',), (cache,)), stats[field]) for cache, stats in caches.items()]))
+    lines.extend(render_metric('wordcloud_render_cache_disk_hits_total', '渲染缓存磁盘命中次数', 'counter',
+                               [('', render_stats['disk_hits'])]))
+    lines.extend(render_metric('wordcloud_render_cache_hit_ratio', '渲染缓存（内存和磁盘）总命中率', 'gauge',
+                               [('', render_stats['hit_ratio'])]))
+    return lines
+
+def queue_metrics():
+    """渲染进程池和异步任务队列的当前状态"""
+    pool_stats = render_pool.stats() if render_pool else {'workers': 0, 'in_flight': 0}
+    job_counts = job_queue.stats()['jobs']
+    lines = []
+    lines.extend(render_metric('wordcloud_render_pool_workers', '渲染进程数', 'gauge',
+                               [('', pool_stats['workers'])]))
+    lines.extend(render_metric('wordcloud_render_pool_in_flight', '渲染进程池中排队和执行中的任务数', 'gauge',
+                               [('', pool_stats['in_flight'])]))
+    admission_stats = render_admission.stats()
+    lines.extend(render_metric('wordcloud_render_in_flight', '正在进行的渲染数（准入控制）', 'gauge',
+                               [('', admission_stats['in_flight'])]))
+    lines.extend(render_metric('wordcloud_render_reserved_bytes', '正在进行的渲染预计占用的内存', 'gauge',
+                               [('', admission_stats['reserved_bytes'])]))
+    lines.extend(render_metric('wordcloud_render_rejected_total', '因服务器繁忙被拒绝的渲染数', 'counter',
+                               [('', admission_stats['rejected'])]))
+    lines.extend(render_metric('wordcloud_jobs', '异步任务数（按状态）', 'gauge', [
+        (_format_labels(('status',), (status,)), count) for status, count in sorted(job_counts.items())]))
+    return lines
+
+class RenderQueueFull(Exception):
+    """渲染队列已满"""
+
+class RenderTimeout(Exception):
+    """渲染任务超时"""
+
+class RenderAdmission:
+    """渲染准入控制：限制同时进行的渲染数和预计内存占用的总和，超出时拒绝（或等待）新的渲染
+
+    没有其他渲染在进行时总是放行，单个请求的上限由 RENDER_MEMORY_MAX_PER_REQUEST 保证
+    """
+
+    def __init__(self, max_in_flight=RENDER_QUEUE_DEPTH, memory_budget=RENDER_MEMORY_BUDGET):
+        self.max_in_flight = max_in_flight
+        self.memory_budget = memory_budget
+        self.in_flight = 0
+        self.reserved = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, nbytes):
+        if self.in_flight == 0:
+            return True
+        return self.in_flight < self.max_in_flight and self.reserved + nbytes <= self.memory_budget
+
+    @contextlib.contextmanager
+    def admit(self, nbytes, block=False, timeout=None):
+        """占用渲染名额和 nbytes 预计内存，容量不足时抛出 RenderQueueFull（block 为 True 时等待）"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._fits(nbytes), timeout if block else 0):
+                self.rejected += 1
+                raise RenderQueueFull('服务器繁忙，请稍后重试')
+            self.in_flight += 1
+            self.reserved += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self.reserved -= nbytes
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'reserved_bytes': self.reserved,
+                'memory_budget': self.memory_budget,
+                'rejected': self.rejected
+            }
+
+render_admission = RenderAdmission()
+
+def preload_shared_state():
+    """预加载依赖、字体、地图模板和常用掩码
+
+    渲染进程启动时执行；serve 模式下在 gunicorn 主进程中执行一次，fork 出的工作进程以写时复制的方式共享
+    """
+    load_wordcloud_class()
+    font_registry.preload()
+    for filename in ('chinamap.jpg', 'shanghai.png'):
+        try:
+            _load_map_template(filename)
+        except OSError as e:
+            print(f"预加载地图模板失败: {e}")
+    warm_mask_cache()
+
+# fork 出的渲染进程会继承服务器进程的信号处理函数，初始化时恢复默认处理
+RENDER_WORKER_DEFAULT_SIGNALS = ('SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1', 'SIGUSR2', 'SIGCHLD', 'SIGWINCH')
+
+def _init_render_worker():
+    """渲染进程初始化：预加载字体、地图模板和常用掩码，使进程启动后即处于预热状态
+
+    fork 启动的进程已经从父进程继承了预加载的数据（写时复制），这里只是命中缓存
+    """
+    for name in RENDER_WORKER_DEFAULT_SIGNALS:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    
+    # fork 出的进程继承了进程池全部管道的两端，父进程被强制结束时读不到EOF，需要自己检测父进程是否还在
+    parent_pid = os.getppid()
+    
+    def exit_with_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+    preload_shared_state()
+
+def _run_with_deadline(timeout, fn, *args):
+    """在渲染进程中执行任务，超过 timeout 秒时用 SIGALRM 中断任务，使工作进程可以接收下一个任务
+
+    不支持 SIGALRM 的平台（Windows）不在进程内中断，由 RenderPool 在超时后重启进程池
+    """
+    if not hasattr(signal, 'setitimer'):
+        return fn(*args)
+    
+    def on_timeout(signum, frame):
+        raise RenderTimeout('渲染超时，请减小图片尺寸或词汇数量后重试')
+    
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+class RenderPool:
+    """渲染进程池，限制排队深度并为每个任务设置超时
+
+    fork 为 True 时（仅限支持 fork 的平台）由 start() 以 fork 方式启动工作进程，共享父进程中预加载的数据；
+    start() 必须在父进程还没有其他线程时调用。其他情况下（包括超时重启后在请求线程中重新创建）使用 spawn
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, queue_depth=RENDER_QUEUE_DEPTH, timeout=RENDER_JOB_TIMEOUT, fork=False):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.fork = fork and 'fork' in multiprocessing.get_all_start_methods()
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.start_method = None
+        self.in_flight = 0
+
+    def _get_executor(self, start_method='spawn'):
+        with self._lock:
+            if self._executor is None:
+                # 默认使用spawn启动进程，避免fork带有线程的服务器进程
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(start_method),
+                    initializer=_init_render_worker
+                )
+                self.start_method = start_method
+            return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, block=False):
+        """提交任务到进程池，队列已满时抛出 RenderQueueFull（block 为 True 时等待空位）"""
+        if not self._slots.acquire(blocking=block):
+            raise RenderQueueFull('渲染队列已满，请稍后重试')
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset()
+            self._release(None)
+            raise
+        # 任务真正结束时才释放队列位置，超时返回的任务仍计入队列深度
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, timeout=None, block=False):
+        """提交任务并等待结果，超时抛出 RenderTimeout
+
+        工作进程中的任务同样在超时后被中断；仍未停止时（例如卡在C扩展中）在 RENDER_KILL_GRACE 秒后重启进程池
+        """
+        timeout = timeout or self.timeout
+        future = self.submit(_run_with_deadline, timeout, fn, *args, block=block)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if not future.cancel():
+                executor = self._executor
+                timer = threading.Timer(RENDER_KILL_GRACE, self._terminate_if_running, (future, executor))
+                timer.daemon = True
+                timer.start()
+            raise RenderTimeout('渲染超时，请减小图片尺寸或词汇数量后重试')
+        except BrokenProcessPool:
+            self._reset()
+            raise
+
+    def _terminate_if_running(self, future, executor):
+        """超时的任务仍在执行时终止该进程池的全部工作进程（进程池中的其他任务会失败），下次提交时重新创建"""
+        if future.done() or executor is None:
+            return
+        print("⚠️  渲染任务超时后仍未停止，重启渲染进程池")
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _reset(self):
+        """工作进程异常退出后丢弃进程池，下次提交时重新创建"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """提前创建进程池并启动全部工作进程"""
+        executor = self._get_executor('fork' if self.fork else 'spawn')
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        self._reset()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'timeout': self.timeout,
+                'start_method': self.start_method
+            }
+
+render_pool = None
+
+def configure_render_pool(workers=None, queue_depth=None, timeout=None, fork=False):
+    """按配置（重新）创建渲染进程池，workers 为 0 时关闭进程池，fork 见 RenderPool"""
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown()
+    workers = RENDER_WORKERS if workers is None else workers
+    render_pool = RenderPool(
+        workers,
+        RENDER_QUEUE_DEPTH if queue_depth is None else queue_depth,
+        RENDER_JOB_TIMEOUT if timeout is None else timeout,
+        fork
+    ) if workers > 0 else None
+    return render_pool
+
+def _render_with_timings(params):
+    """渲染并记录各阶段耗时（在渲染进程中执行），返回 (图片字节, MIME类型, 布局, 耗时字典)"""
+    timings = {}
+    image_bytes, mime_type, layout = render_with_layout(params, timings)
+    return image_bytes, mime_type, layout, timings
+
+def run_task(fn, *args, timeout=None, block=False):
+    """执行渲染相关的函数：启用进程池时交给工作进程，否则在当前线程执行"""
+    if render_pool is None:
+        return fn(*args)
+    return render_pool.run(fn, *args, timeout=timeout, block=block)
+
+def run_render(params, timeout=None, block=False, timings=None):
+    """执行渲染：启用进程池时交给工作进程，否则在当前线程渲染，返回 (图片字节, MIME类型, 布局)"""
+    if render_pool is None:
+        return render_with_layout(params, timings)
+    
+    start = time.perf_counter()
+    image_bytes, mime_type, layout, worker_timings = render_pool.run(
+        _render_with_timings, params, timeout=timeout, block=block)
+    if timings is not None:
+        # 总耗时中除去工作进程内各阶段的部分，即排队和进程间传输的耗时
+        timings['queue'] = max(0.0, time.perf_counter() - start - sum(worker_timings.values()))
+        for name, value in worker_timings.items():
+            timings[name] = timings.get(name, 0.0) + value
+    return image_bytes, mime_type, layout
+
+def render_with_cache(params, use_cache=True, timeout=None, block=False, timings=None):
+    """带缓存的渲染，返回 (图片字节, MIME类型, 结果ID, 是否命中缓存)；timings 不为None时记录各阶段耗时
+
+    新生成的布局保存在 layout_store 中（布局ID 为 layout_key(params)），供 /recolor 重新着色
+    """
+    cache_key = render_cache_key(params)
+    with stage(timings, 'cache'):
+        cached = render_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        image_bytes, mime_type, result_id = cached
+        result_store.put(result_id, (image_bytes, mime_type))
+        return image_bytes, mime_type, result_id, True
+    
+    # 未命中缓存时总是计时，用于 /metrics 中的各阶段直方图
+    render_timings = {}
+    admission_start = time.perf_counter()
+    with render_admission.admit(estimate_render_memory(params), block=block, timeout=timeout):
+        start = time.perf_counter()
+        render_timings['admission'] = start - admission_start
+        image_bytes, mime_type, layout = run_render(params, timeout=timeout, block=block, timings=render_timings)
+        observe_render(params, render_timings, time.perf_counter() - start)
+    if timings is not None:
+        timings.update(render_timings)
+    
+    with stage(timings, 'store'):
+        result_id = store_result(image_bytes, mime_type)
+        render_cache.put(cache_key, image_bytes, mime_type, result_id)
+        layout_store.put(layout_key(params), layout)
+    return image_bytes, mime_type, result_id, False
+
+class Job:
+    """异步渲染任务"""
+
+    def __init__(self, params, priority=0, use_cache=True):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.priority = priority
+        self.use_cache = use_cache
+        self.status = 'queued'    # queued / running / done / failed / cancelled
+        self.progress = 0.0
+        self.error = None
+        self.result_id = None
+        self.cached = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        result = {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'priority': self.priority,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.error:
+            result['error'] = self.error
+        if self.status == 'done':
+            result['cached'] = self.cached
+            result['result_id'] = self.result_id
+            result['result_url'] = f'/jobs/{self.id}/result'
+            layout_id = layout_key(self.params)
+            if layout_id in layout_store:
+                result['layout_id'] = layout_id
+        return result
+
+class JobQueueFull(Exception):
+    """异步任务队列已满"""
+
+class JobQueue:
+    """进程内的优先级任务队列，priority 越大越先执行，支持取消排队中的任务"""
+
+    def __init__(self, runners=JOB_RUNNERS, max_queued=JOB_QUEUE_MAX):
+        self.runners = runners
+        self.max_queued = max_queued
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_runners(self):
+        # 在第一次提交任务时才启动执行线程
+        if self._threads:
+            return
+        for i in range(self.runners):
+            thread = threading.Thread(target=self._run, name=f'job-runner-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, params, priority=0, use_cache=True):
+        """提交任务，返回 Job 对象"""
+        job = Job(params, priority, use_cache)
+        with self._cond:
+            self._purge()
+            if self._queued_count() >= self.max_queued:
+                raise JobQueueFull('任务队列已满，请稍后重试')
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-priority, next(self._counter), job.id))
+            self._ensure_runners()
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """返回排队中任务前面的任务数"""
+        with self._cond:
+            if job.status != 'queued':
+                return None
+            key = next((item for item in self._heap if item[2] == job.id), None)
+            if key is None:
+                return None
+            return sum(1 for item in self._heap
+                       if item < key and self._jobs[item[2]].status == 'queued')
+
+    def cancel(self, job_id):
+        """取消任务；运行中的任务会在完成后丢弃结果，返回是否取消成功"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return True
+
+    def _queued_count(self):
+        return sum(1 for job in self._jobs.values() if job.status == 'queued')
+
+    def _purge(self):
+        """清理超过保留时间的已结束任务"""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > JOB_RETENTION]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, job_id = heapq.heappop(self._heap)
+                    job = self._jobs.get(job_id)
+                    # 跳过已取消的任务
+                    if job is not None and job.status == 'queued':
+                        job.status = 'running'
+                        job.progress = 0.1
+                        job.started_at = time.time()
+                        return job
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                image_bytes, mime_type, result_id, cached = self._render(job)
+            except Exception as e:
+                with self._cond:
+                    if job.status == 'running':
+                        job.status = 'failed'
+                        job.error = str(e)
+                        job.finished_at = time.time()
+                continue
+            with self._cond:
+                if job.status == 'running':
+                    job.status = 'done'
+                    job.progress = 1.0
+                    job.result_id = result_id
+                    job.cached = cached
+                    job.finished_at = time.time()
+
+    def _render(self, job):
+        # 渲染进程池繁忙时等待空位，而不是让任务失败
+        while True:
+            try:
+                return render_with_cache(job.params, use_cache=job.use_cache, timeout=JOB_TIMEOUT)
+            except RenderQueueFull:
+                if job.status != 'running':
+                    raise
+                time.sleep(0.5)
+
+    def stats(self):
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {'runners': self.runners, 'max_queued': self.max_queued, 'jobs': counts}
+
+job_queue = JobQueue()
+
+def iter_batch_results(items, use_cache=True):
+    """并行渲染一批参数，按完成顺序逐个产出 (序号, 结果, 错误信息)
+
+    结果为 (图片字节, MIME类型, 结果ID, 是否命中缓存)。参数完全相同的条目只渲染一次，
+    同一形状和尺寸的掩码通过掩码缓存在各条目之间共享
+    """
+    # 按缓存键合并重复的条目
+    groups = OrderedDict()
+    for index, params in items:
+        groups.setdefault(render_cache_key(params), (params, []))[1].append(index)
+    
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_PARALLEL) as executor:
+        futures = {
+            executor.submit(render_with_cache, params, use_cache, JOB_TIMEOUT, True): indexes
+            for params, indexes in groups.values()
+        }
+        for future in as_completed(futures):
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, str(e)
+            for index in futures[future]:
+                yield index, result, error
+
+@app.before_request
+def track_request_start():
+    """记录请求开始时间和进行中的请求数，请求体过大时直接拒绝"""
+    if request.content_length and request.content_length > MAX_REQUEST_BYTES:
+        return jsonify({'error': f'请求体不能超过 {MAX_REQUEST_BYTES // (1024 * 1024)}MB'}), 413
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc(request.endpoint or 'unknown')
+
+@app.after_request
+def track_request_end(response):
+    """记录请求耗时"""
+    start = g.get('request_start')
+    if start is not None:
+        request_histogram.observe(time.perf_counter() - start, request.endpoint or 'unknown',
+                                  request.method, str(response.status_code))
+    return response
+
+@app.teardown_request
+def track_request_teardown(_error=None):
+    """请求结束（包括异常）时减少进行中的请求数"""
+    if g.pop('request_start', None) is not None:
+        requests_in_flight.dec(request.endpoint or 'unknown')
+
 @app.route('/')
 def index():
     """主页面"""
     return send_from_directory('.', 'index.html')
 
+def result_response(image_bytes, mime_type, result_id, cached, response_format, timings, layout_id=None):
+    """按响应方式返回生成结果：binary 直接返回图片字节，json 内嵌base64图片，url 只返回结果地址"""
+    # 二进制模式：直接返回图片字节
+    if response_format == 'binary':
+        response = image_response(image_bytes, mime_type, result_id)
+        response.headers['X-Result-Id'] = result_id
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        if layout_id:
+            response.headers['X-Layout-Id'] = layout_id
+        response.headers['Server-Timing'] = server_timing_header(timings)
+        return response
+    
+    result = {
+        'success': True,
+        'cached': cached,
+        'result_id': result_id,
+        'url': url_for('get_result', result_id=result_id)
+    }
+    if layout_id:
+        result['layout_id'] = layout_id
+    if response_format == 'json':
+        with stage(timings, 'base64'):
+            img_base64 = base64.b64encode(image_bytes).decode()
+            result['image'] = f'data:{mime_type};base64,{img_base64}'
+    with stage(timings, 'serialize'):
+        response = jsonify(result)
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
 @app.route('/generate', methods=['POST'])
 def generate_wordcloud():
-    """生成词云图的API接口"""
+    """生成词云图的API接口，各阶段耗时通过 Server-Timing 响应头返回"""
+    timings = {}
     try:
-        data = request.get_json()
-        text = data.get('text', '')
-        shape = data.get('shape', 'circle')
-        width = int(data.get('width', 800))
-        height = int(data.get('height', 400))
-        background_color = data.get('background_color', 'white')
-        image_data = data.get('image_data', None)
-        use_image_colors = data.get('use_image_colors', False)
-        font_name = data.get('font_name', 'default')
-        color_theme = data.get('color_theme', 'viridis')
-        
-        if not text.strip():
-            return jsonify({'error': '请输入词汇内容'}), 400
-        
-        # 如果选择了自定义图片但没有提供图片数据
-        if shape == 'custom' and not image_data:
-            return jsonify({'error': '请上传自定义图片模板'}), 400
-        
-        # 创建词云 - 使用用户输入的尺寸，默认为800x800
-        width = width if width > 0 else 800
-        height = height if height > 0 else 800
-        wordcloud = create_wordcloud(
-            text, shape, width, height, background_color, 
-            image_data=image_data, 
-            use_image_colors=use_image_colors,
-            font_name=font_name,
-            color_theme=color_theme
-        )
+        data = request.get_json(silent=True)
+        with stage(timings, 'validate'):
+            params, error = parse_render_params(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # 保存为图片并转换为base64 - 使用用户输入的尺寸
-        img_buffer = io.BytesIO()
+        response_format = get_response_format(data)
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({'error': f'不支持的响应方式: {response_format}'}), 400
         
-        # 创建词云图像
-        fig = plt.figure(figsize=(width/100, height/100), dpi=100)
-        ax = fig.add_subplot(111)
-        ax.imshow(wordcloud, interpolation='bilinear')
-        ax.axis('off')
+        # 快速预览：先返回缩小画布上的预览图，再返回复用同一布局放大绘制的完整图片
+        if data.get('preview'):
+            return preview_response(params, use_cache=data.get('cache', True),
+                                    include_image=response_format == 'json')
         
-        # 调整布局
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0, wspace=0, hspace=0)
-        
-        # 对于中国地图和上海地图形状，保持纵横比并裁剪空白区域
-        if shape in ['china_map', 'shanghai_map']:
-            # 获取词云图像的数组
-            wordcloud_array = np.array(wordcloud)
-            
-            # 将图像转换为灰度以找到非空白区域
-            gray = np.mean(wordcloud_array, axis=2)
-            
-            # 找到非空白区域的边界
-            non_empty = gray < 255  # 假设背景是白色(255)
-            if np.any(non_empty):
-                y_indices, x_indices = np.where(non_empty)
-                min_y, max_y = np.min(y_indices), np.max(y_indices)
-                min_x, max_x = np.min(x_indices), np.max(x_indices)
-                
-                # 裁剪到非空白区域
-                cropped_array = wordcloud_array[min_y:max_y+1, min_x:max_x+1]
-                
-                # 创建新的图形，保持裁剪后的纵横比
-                cropped_height, cropped_width = cropped_array.shape[:2]
-                aspect_ratio = cropped_width / cropped_height
-                
-                # 计算保持纵横比的尺寸
-                if width / height > aspect_ratio:
-                    new_height = height
-                    new_width = int(height * aspect_ratio)
-                else:
-                    new_width = width
-                    new_height = int(width / aspect_ratio)
-                
-                # 创建新的图形
-                plt.close(fig)  # 关闭旧图形
-                fig = plt.figure(figsize=(new_width/100, new_height/100), dpi=100)
-                ax = fig.add_subplot(111)
-                ax.imshow(cropped_array, interpolation='bilinear')
-                ax.axis('off')
-                plt.subplots_adjust(left=0, right=1, top=1, bottom=0, wspace=0, hspace=0)
-        
-        # 保存图像到缓冲区
-        fig.savefig(img_buffer, format='png', bbox_inches='tight', 
-                   facecolor=background_color, edgecolor='none', dpi=100)
-        
-        # 关闭图形，释放内存
-        plt.close(fig)
-        
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        # 相同参数的请求直接使用缓存结果（cache 为 false 时强制重新生成）
+        image_bytes, mime_type, result_id, cached = render_with_cache(
+            params, use_cache=data.get('cache', True), timings=timings)
         
         # 可选：保存词云图片到文件
         save_to_file = data.get('save_to_file', False)
         if save_to_file:
-            filename = data.get('filename', f'wordcloud_{shape}_{width}x{height}.png')
+            shape, width, height = params['shape'], params['width'], params['height']
+            extension = OUTPUT_FORMATS[params['output_format']][2]
+            filename = data.get('filename', f'wordcloud_{shape}_{width}x{height}.{extension}')
             output_path = os.path.join(os.path.dirname(__file__), 'output', filename)
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            # 将缓冲区内容保存到文件
+            # 将图片内容保存到文件
             with open(output_path, 'wb') as f:
-                f.write(img_buffer.getvalue())
+                f.write(image_bytes)
+        
+        # 布局仍在存储中时返回布局ID，之后只改颜色可以调用 /recolor
+        layout_id = layout_key(params)
+        if layout_id not in layout_store:
+            layout_id = None
+        return result_response(image_bytes, mime_type, result_id, cached, response_format, timings, layout_id)
+        
+    except InputError as e:
+        return jsonify({'error': str(e)}), 400
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RENDER_RETRY_AFTER)}
+    except RenderTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """批量生成词云图，以NDJSON流（默认）或ZIP压缩包返回结果
+
+    请求体: {"items": [...], "defaults": {...}, "format": "ndjson" | "zip", "include_image": false}
+    items 中每一项的字段与 /generate 相同，未指定的字段使用 defaults 中的值
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体必须是JSON对象'}), 400
+    items = data.get('items') or []
+    defaults = data.get('defaults') or {}
+    batch_format = data.get('format', 'ndjson')
+    include_image = data.get('include_image', False)
+    use_cache = data.get('cache', True)
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '请提供要生成的词云列表 items'}), 400
+    if not isinstance(defaults, dict):
+        return jsonify({'error': 'defaults 必须是对象'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'单次最多生成 {BATCH_MAX_ITEMS} 个词云'}), 400
+    if batch_format not in ('ndjson', 'zip'):
+        return jsonify({'error': f'不支持的批量返回格式: {batch_format}'}), 400
+    
+    # 先校验全部条目，校验失败的条目直接作为错误结果返回
+    names = []
+    valid = []
+    errors = {}
+    for index, item in enumerate(items):
+        spec = dict(defaults)
+        try:
+            if isinstance(item, dict):
+                spec.update(item)
+                params, error = parse_render_params(spec)
+            else:
+                params, error = None, '每一项必须是JSON对象'
+        except (TypeError, ValueError) as e:
+            params, error = None, str(e)
+        names.append(str(spec.get('name', index)))
+        if error:
+            errors[index] = error
+        else:
+            valid.append((index, params))
+    
+    def results():
+        for index, error in errors.items():
+            yield index, None, error
+        yield from iter_batch_results(valid, use_cache)
+    
+    if batch_format == 'zip':
+        return _batch_zip_response(results(), names)
+    
+    def generate():
+        for index, result, error in results():
+            line = {'index': index, 'name': names[index], 'success': error is None}
+            if error is not None:
+                line['error'] = error
+            else:
+                image_bytes, mime_type, result_id, cached = result
+                line.update({'result_id': result_id, 'cached': cached, 'url': f'/result/{result_id}'})
+                if include_image:
+                    img_base64 = base64.b64encode(image_bytes).decode()
+                    line['image'] = f'data:{mime_type};base64,{img_base64}'
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _image_data_url(image_bytes, mime_type):
+    return f'data:{mime_type};base64,{base64.b64encode(image_bytes).decode()}'
+
+def preview_response(params, use_cache=True, include_image=True):
+    """快速预览：以NDJSON流依次返回预览图（stage 为 preview）和完整尺寸的图片（stage 为 final）
+
+    完整尺寸的图片复用预览的布局放大绘制，不再重新布局
+    """
+    # 放大绘制的结果与完整尺寸布局的结果不同，单独缓存
+    final_params = dict(params, preview=True)
+    cache_key = render_cache_key(final_params)
+    layout_id = layout_key(final_params)
+    
+    def final_line(image_bytes, mime_type, result_id, cached):
+        line = {'stage': 'final', 'cached': cached, 'result_id': result_id, 'url': f'/result/{result_id}'}
+        if layout_id in layout_store:
+            line['layout_id'] = layout_id
+        if include_image:
+            line['image'] = _image_data_url(image_bytes, mime_type)
+        return json.dumps(line, ensure_ascii=False) + '\n'
+    
+    cached = render_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        image_bytes, mime_type, result_id = cached
+        result_store.put(result_id, (image_bytes, mime_type))
+        return Response(final_line(image_bytes, mime_type, result_id, True), mimetype='application/x-ndjson')
+    
+    # 预览在返回响应之前同步生成，队列已满等错误可以直接返回对应的状态码
+    width, height = preview_size(params['width'], params['height'])
+    start = time.perf_counter()
+    with render_admission.admit(estimate_render_memory(dict(params, width=width, height=height))):
+        preview_bytes, preview_mime, layout = run_task(render_preview, params)
+    preview_seconds = time.perf_counter() - start
+    
+    def generate():
+        yield json.dumps({
+            'stage': 'preview',
+            'width': width,
+            'height': height,
+            'seconds': round(preview_seconds, 3),
+            'image': _image_data_url(preview_bytes, preview_mime)
+        }, ensure_ascii=False) + '\n'
+        try:
+            if (width, height) == (params['width'], params['height']):
+                # 画布不超过 PREVIEW_MAX_SIDE 时预览已经是完整尺寸的图片，不再重复绘制
+                image_bytes, mime_type = preview_bytes, preview_mime
+            else:
+                with render_admission.admit(estimate_render_memory(params), block=True, timeout=RENDER_JOB_TIMEOUT):
+                    image_bytes, mime_type = run_task(render_layout, params, layout, block=True)
+            result_id = store_result(image_bytes, mime_type)
+            render_cache.put(cache_key, image_bytes, mime_type, result_id)
+            layout_store.put(layout_id, layout)
+            yield final_line(image_bytes, mime_type, result_id, False)
+        except Exception as e:
+            yield json.dumps({'stage': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/recolor', methods=['POST'])
+def recolor_wordcloud():
+    """使用已生成的布局重新着色并输出（颜色主题、图片颜色、背景色），不重新布局
+
+    请求体: {"layout_id": ..., "color_theme": ..., "use_image_colors": ..., "background_color": ...}，
+    输出格式和响应方式的参数与 /generate 相同
+    """
+    timings = {}
+    try:
+        data = request.get_json(silent=True)
+        with stage(timings, 'validate'):
+            params, error = parse_recolor_params(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        response_format = get_response_format(data)
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({'error': f'不支持的响应方式: {response_format}'}), 400
+        
+        layout = layout_store.lookup(params['layout_id'])
+        if layout is None:
+            return jsonify({'error': '布局不存在或已过期，请重新生成词云'}), 404
+        
+        cache_key = render_cache_key(params)
+        with stage(timings, 'cache'):
+            cached = render_cache.get(cache_key) if data.get('cache', True) else None
+        if cached is not None:
+            image_bytes, mime_type, result_id = cached
+            result_store.put(result_id, (image_bytes, mime_type))
+        else:
+            width, height = layout['size']
+            with render_admission.admit(estimate_render_memory(dict(params, width=width, height=height))):
+                with stage(timings, 'recolor'):
+                    image_bytes, mime_type = run_task(render_layout, params, layout, True)
+            with stage(timings, 'store'):
+                result_id = store_result(image_bytes, mime_type)
+                render_cache.put(cache_key, image_bytes, mime_type, result_id)
+        return result_response(image_bytes, mime_type, result_id, cached is not None, response_format,
+                               timings, params['layout_id'])
+        
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RENDER_RETRY_AFTER)}
+    except RenderTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _batch_zip_response(results, names):
+    """将批量生成的结果打包为ZIP（包含 manifest.json 记录每一项的结果）"""
+    zip_buffer = io.BytesIO()
+    manifest = []
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for index, result, error in results:
+            entry = {'index': index, 'name': names[index]}
+            if error is not None:
+                entry['error'] = error
+            else:
+                image_bytes, mime_type, result_id, _ = result
+                extension = next(ext for _, mime, ext in OUTPUT_FORMATS.values() if mime == mime_type)
+                # 图片已经压缩过，直接存储即可
+                safe_name = re.sub(r'[^\w\-.]+', '_', names[index])
+                entry['file'] = f'{index:04d}_{safe_name}.{extension}'
+                entry['result_id'] = result_id
+                zf.writestr(entry['file'], image_bytes)
+            manifest.append(entry)
+        manifest.sort(key=lambda entry: entry['index'])
+        zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    
+    response = Response(zip_buffer.getvalue(), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=wordclouds.zip'
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """提交异步词云生成任务，立即返回任务ID"""
+    try:
+        data = request.get_json(silent=True)
+        params, error = parse_render_params(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        return jsonify({
-            'success': True,
-            'image': f'data:image/png;base64,{img_base64}'
-        })
+        try:
+            priority = int(data.get('priority', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'priority 必须是整数'}), 400
         
+        job = job_queue.submit(params, priority=priority,
+                               use_cache=data.get('cache', True))
+        result = job.to_dict()
+        result['position'] = job_queue.position(job)
+        return jsonify(result), 202, {'Location': f'/jobs/{job.id}'}
+    
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RENDER_RETRY_AFTER)}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步任务状态和进度"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    result = job.to_dict()
+    result['position'] = job_queue.position(job)
+    return jsonify(result)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消异步任务"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({'error': f'任务已结束，无法取消（状态: {job.status}）'}), 409
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    """获取异步任务生成的图片"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if job.status != 'done':
+        return jsonify({'error': f'任务尚未完成（状态: {job.status}）', 'status': job.status}), 409
+    result = result_store.lookup(job.result_id)
+    if result is None:
+        return jsonify({'error': '结果不存在或已过期'}), 404
+    image_bytes, mime_type = result
+    return image_response(image_bytes, mime_type, job.result_id)
+
+@app.route('/result/<result_id>')
+def get_result(result_id):
+    """获取已生成的词云图片"""
+    result = result_store.lookup(result_id)
+    if result is None:
+        return jsonify({'error': '结果不存在或已过期'}), 404
+    image_bytes, mime_type = result
+    return image_response(image_bytes, mime_type, result_id)
+
+@app.route('/templates', methods=['POST'])
+def upload_template():
+    """上传形状模板，之后可以在 /generate 中通过 template_id 使用"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': '请求体必须是JSON对象'}), 400
+        image_data = data.get('image_data')
+        if not image_data:
+            return jsonify({'error': '请上传模板图片'}), 400
+        meta, created = template_library.add(image_data, data.get('name'))
+        return jsonify({'success': True, 'created': created, 'template': meta}), 201 if created else 200
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """获取模板列表"""
+    return jsonify({'templates': template_library.list()})
+
+@app.route('/templates/<template_id>', methods=['GET'])
+def get_template(template_id):
+    """获取模板的预处理图片"""
+    if not template_library.exists(template_id):
+        return jsonify({'error': '模板不存在'}), 404
+    return send_from_directory(os.path.dirname(template_library.image_path(template_id)), 'template.png')
+
 @app.route('/shapes')
 def get_shapes():
     """获取可用形状列表"""
@@ -754,16 +3335,204 @@ def get_shapes():
 
 @app.route('/fonts')
 def get_fonts():
-    """获取可用字体列表"""
-    return jsonify({'fonts': FONT_OPTIONS})
+    """获取已安装的字体列表"""
+    return jsonify({'fonts': font_registry.available()})
+
+@app.route('/fonts/reload', methods=['POST'])
+def reload_fonts():
+    """重新扫描字体目录（安装新字体后调用）"""
+    return jsonify({'fonts': font_registry.scan()})
 
 @app.route('/themes')
 def get_themes():
     """获取可用颜色主题列表"""
     return jsonify({'themes': COLOR_THEMES})
 
-def run_app():
-    """启动Flask应用"""
+@app.route('/cache/stats')
+def get_cache_stats():
+    """获取缓存统计信息"""
+    return jsonify({
+        'mask_cache': mask_cache.stats(),
+        'result_store': result_store.stats(),
+        'layout_store': layout_store.stats(),
+        'render_cache': render_cache.stats(),
+        'render_pool': render_pool.stats() if render_pool else None,
+        'render_admission': render_admission.stats(),
+        'job_queue': job_queue.stats()
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 格式的监控指标：各阶段耗时直方图、缓存命中率、进行中的请求数"""
+    lines = []
+    for metric in (stage_histogram, render_histogram, request_histogram):
+        lines.extend(metric.render())
+    lines.extend(requests_in_flight.render())
+    lines.extend(cache_metrics())
+    lines.extend(queue_metrics())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# 渲染参数文件中需要转换为布尔值的字段（CSV中均为字符串）
+BOOLEAN_SPEC_FIELDS = ('use_image_colors',)
+
+def iter_spec_file(path):
+    """逐条读取渲染参数文件（.jsonl 每行一个JSON对象，.csv 首行为字段名），不会一次性加载整个文件"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                spec = {key: value for key, value in row.items() if key and value not in (None, '')}
+                for field in BOOLEAN_SPEC_FIELDS:
+                    if field in spec:
+                        spec[field] = spec[field].strip().lower() in ('1', 'true', 'yes', 'y')
+                yield spec
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    # 无法解析的行产出None，由调用方记录为失败项
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+
+def _render_timed(params):
+    """渲染并计时（在渲染进程中执行），返回 (图片字节, MIME类型, 耗时秒数)"""
+    start = time.perf_counter()
+    image_bytes, mime_type = render_from_params(params)
+    return image_bytes, mime_type, time.perf_counter() - start
+
+def render_spec_file(input_path, out_dir, workers=RENDER_WORKERS):
+    """离线批量渲染：读取参数文件，将图片写入 out_dir，并生成逐项耗时报告 report.jsonl
+
+    返回 (成功数, 失败数)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    report_path = os.path.join(out_dir, 'report.jsonl')
+    succeeded = failed = 0
+    start = time.perf_counter()
+    
+    executor = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_render_worker
+        )
+    
+    def write_result(report, index, name, params, outcome, error):
+        nonlocal succeeded, failed
+        entry = {'index': index, 'name': name}
+        if error is None:
+            image_bytes, mime_type, seconds = outcome
+            extension = OUTPUT_FORMATS[params['output_format']][2]
+            safe_name = re.sub(r'[^\w\-.]+', '_', name)
+            filename = f'{index:05d}_{safe_name}.{extension}'
+            with open(os.path.join(out_dir, filename), 'wb') as f:
+                f.write(image_bytes)
+            entry.update({'file': filename, 'bytes': len(image_bytes), 'seconds': round(seconds, 4),
+                          'shape': params['shape'], 'width': params['width'], 'height': params['height']})
+            succeeded += 1
+        else:
+            entry['error'] = error
+            failed += 1
+        report.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        report.flush()
+        status = f"{entry.get('seconds', 0):.2f}s" if error is None else f'失败: {error}'
+        print(f"  [{index}] {name}: {status}")
+    
+    try:
+        with open(report_path, 'w', encoding='utf-8') as report:
+            pending = {}
+            for index, spec in enumerate(iter_spec_file(input_path)):
+                if not isinstance(spec, dict):
+                    write_result(report, index, str(index), None, None, '无效的参数：每一项必须是JSON对象')
+                    continue
+                name = str(spec.get('name', index))
+                # text_file 相对于参数文件所在目录
+                if spec.get('text_file'):
+                    spec['text_file'] = os.path.join(os.path.dirname(os.path.abspath(input_path)), str(spec['text_file']))
+                try:
+                    params, error = parse_render_params(spec, allow_text_file=True)
+                except (TypeError, ValueError) as e:
+                    params, error = None, str(e)
+                if error:
+                    write_result(report, index, name, params, None, error)
+                    continue
+                
+                if executor is None:
+                    try:
+                        write_result(report, index, name, params, _render_timed(params), None)
+                    except Exception as e:
+                        write_result(report, index, name, params, None, str(e))
+                    continue
+                
+                # 限制同时提交的任务数，保证内存占用不随文件大小增长
+                pending[executor.submit(_render_timed, params)] = (index, name, params)
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _write_future(write_result, report, future, pending.pop(future))
+            
+            for future in as_completed(list(pending)):
+                _write_future(write_result, report, future, pending.pop(future))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    elapsed = time.perf_counter() - start
+    print(f"✅ 完成 {succeeded} 个，失败 {failed} 个，总耗时 {elapsed:.2f}s，报告: {report_path}")
+    return succeeded, failed
+
+def _write_future(write_result, report, future, item):
+    index, name, params = item
+    try:
+        write_result(report, index, name, params, future.result(), None)
+    except Exception as e:
+        write_result(report, index, name, params, None, str(e))
+
+def run_cli_render(argv):
+    """命令行批量渲染入口"""
+    parser = argparse.ArgumentParser(
+        prog='python wordcloud_app.py render',
+        description='不启动服务器，直接批量生成词云图'
+    )
+    parser.add_argument('--input', required=True, help='渲染参数文件（.jsonl 或 .csv），字段与 /generate 相同')
+    parser.add_argument('--out', required=True, help='输出目录')
+    parser.add_argument('--workers', type=int, default=RENDER_WORKERS,
+                        help=f'渲染进程数，0 表示在当前进程中渲染（默认 {RENDER_WORKERS}）')
+    args = parser.parse_args(argv)
+    
+    print(f"🖼️  正在渲染 {args.input} -> {args.out}（{args.workers} 个渲染进程）")
+    _, failed = render_spec_file(args.input, args.out, args.workers)
+    return 1 if failed else 0
+
+def print_startup_report():
+    """打印启动耗时报告"""
+    print("⏱️  启动耗时:")
+    for name, value in startup_report().items():
+        if name == 'max_rss_mb':
+            print(f"    内存峰值: {value:.1f} MB")
+        else:
+            print(f"    {name}: {value * 1000:.1f} ms")
+
+def measure_startup():
+    """依次导入各个重量级依赖并预热，打印每一步的耗时（用于检查冷启动开销）"""
+    load_wordcloud_class()
+    timed_import('numpy')
+    timed_import('PIL.Image')
+    load_pyplot()
+    
+    start = time.perf_counter()
+    font_registry.scan()
+    STARTUP_TIMINGS['font scan'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    warm_mask_cache()
+    STARTUP_TIMINGS['mask warm-up'] = time.perf_counter() - start
+    print_startup_report()
+
+def run_app(open_browser=True):
+    """启动Flask应用（开发服务器），open_browser 为 False 时不自动打开浏览器"""
     print("🚀 启动词云图生成器...")
     print("📍 应用将在 http://localhost:5000 启动")
     print("🔗 请在浏览器中访问上述地址使用应用")
@@ -773,23 +3542,164 @@ def run_app():
     # 确保在正确的目录中运行
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
-    # 自动打开浏览器
-    import webbrowser
-    import threading
+    # 扫描字体目录
+    fonts = font_registry.scan()
+    print(f"🔤 找到 {len(fonts)} 种可用字体")
+    
+    # 预热常用尺寸的形状掩码
+    if MASK_WARMUP_SIZES:
+        print("🔥 正在预热形状掩码缓存...")
+        warm_mask_cache()
+    
+    # 启动渲染进程池
+    if render_pool is not None:
+        print(f"⚙️  正在启动 {render_pool.workers} 个渲染进程...")
+        render_pool.start()
     
-    def open_browser():
-        """延迟打开浏览器，确保服务器已启动"""
-        import time
-        time.sleep(1.5)  # 等待1.5秒让服务器完全启动
-        webbrowser.open('http://localhost:5000')
+    print_startup_report()
     
-    # 在新线程中打开浏览器
-    browser_thread = threading.Thread(target=open_browser)
-    browser_thread.daemon = True
-    browser_thread.start()
+    # 自动打开浏览器
+    if open_browser:
+        import webbrowser
+        
+        def launch_browser():
+            """延迟打开浏览器，确保服务器已启动"""
+            time.sleep(1.5)  # 等待1.5秒让服务器完全启动
+            webbrowser.open('http://localhost:5000')
+        
+        # 在新线程中打开浏览器
+        browser_thread = threading.Thread(target=launch_browser)
+        browser_thread.daemon = True
+        browser_thread.start()
     
     # 运行Flask应用
-    app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
+    try:
+        app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
+    finally:
+        if render_pool is not None:
+            render_pool.shutdown()
+
+def create_app():
+    """WSGI应用工厂：预加载共享数据后返回Flask应用，供外部启动的WSGI服务器使用
+
+    例如 gunicorn --preload -w 4 --threads 4 "wordcloud_app:create_app()"
+    """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    preload_shared_state()
+    return app
+
+def default_wsgi_server():
+    """默认的WSGI服务器：非Windows且安装了gunicorn时使用gunicorn，其次是waitress，都未安装时返回None"""
+    if platform.system() != 'Windows' and importlib.util.find_spec('gunicorn'):
+        return 'gunicorn'
+    if importlib.util.find_spec('waitress'):
+        return 'waitress'
+    return None
+
+def start_worker_render_pool(worker):
+    """gunicorn 工作进程初始化完成后（还没有请求线程）以 fork 方式启动该进程的渲染进程池"""
+    if render_pool is not None:
+        render_pool.start()
+
+def shutdown_worker_render_pool(server, worker):
+    """gunicorn 工作进程退出时关闭该进程的渲染进程池"""
+    if render_pool is not None:
+        render_pool.shutdown()
+
+def run_gunicorn(host, port, workers, threads, timeout):
+    """使用gunicorn运行：应用在主进程中预加载，工作进程及其渲染进程依次fork，共享预加载的字体、模板和掩码"""
+    from gunicorn.app.base import BaseApplication
+    
+    class WordCloudServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)   # 大于1时 gunicorn 自动使用 gthread 工作进程
+            self.cfg.set('timeout', timeout)
+            self.cfg.set('preload_app', True)
+            self.cfg.set('post_worker_init', start_worker_render_pool)
+            self.cfg.set('worker_exit', shutdown_worker_render_pool)
+        
+        def load(self):
+            return app
+    
+    # 把预加载的对象移出垃圾回收的跟踪范围，避免工作进程的垃圾回收遍历这些对象，使共享的内存页被复制
+    gc.collect()
+    gc.freeze()
+    WordCloudServer().run()
+
+def run_waitress(host, port, threads):
+    """使用waitress运行（单进程多线程，渲染交给渲染进程池）"""
+    from waitress import serve
+    serve(app, host=host, port=port, threads=threads)
+
+def run_serve(argv):
+    """生产部署入口：使用gunicorn或waitress运行应用，不打开浏览器"""
+    parser = argparse.ArgumentParser(
+        prog='python wordcloud_app.py serve',
+        description='使用生产级WSGI服务器（gunicorn 或 waitress）运行词云图生成器'
+    )
+    parser.add_argument('--server', choices=('gunicorn', 'waitress'),
+                        help='WSGI服务器（默认：非Windows且安装了gunicorn时使用gunicorn，否则使用waitress）')
+    parser.add_argument('--host', default=SERVE_HOST, help=f'监听地址（默认 {SERVE_HOST}）')
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help=f'监听端口（默认 {SERVE_PORT}）')
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS,
+                        help=f'gunicorn 工作进程数（默认 {SERVE_WORKERS}，waitress 忽略）；多于1个时各进程不共享结果、布局和异步任务')
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS,
+                        help=f'每个工作进程的线程数（默认 {SERVE_THREADS}）')
+    parser.add_argument('--render-workers', type=int,
+                        help=f'每个工作进程的渲染进程数，在预加载之后以 fork 方式启动并共享预加载的数据'
+                             f'（默认 {RENDER_WORKERS}；gunicorn 使用多个工作进程时默认为 0，即在请求线程中渲染）')
+    parser.add_argument('--timeout', type=int, default=SERVE_TIMEOUT,
+                        help=f'gunicorn 工作进程超时时间（秒，默认 {SERVE_TIMEOUT}）')
+    args = parser.parse_args(argv)
+    
+    server = args.server or default_wsgi_server()
+    if server is None or importlib.util.find_spec(server) is None:
+        package = server or ('waitress' if platform.system() == 'Windows' else 'gunicorn')
+        print(f"❌ 未安装 {package}，请先运行 pip install {package}")
+        return 1
+    
+    # gunicorn 使用多个工作进程时已经利用了多核，默认不再为每个工作进程创建渲染进程池
+    multi_process = server == 'gunicorn' and args.workers > 1
+    render_workers = args.render_workers
+    if render_workers is None:
+        render_workers = 0 if multi_process else RENDER_WORKERS
+    # 渲染进程在预加载之后以 fork 方式启动，共享预加载的数据
+    configure_render_pool(render_workers, fork=True)
+    
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    print(f"🚀 使用 {server} 启动词云图生成器: http://{args.host}:{args.port}")
+    if server == 'gunicorn':
+        print(f"⚙️  {args.workers} 个工作进程 × {args.threads} 个线程，每个工作进程 {render_workers} 个渲染进程")
+    else:
+        print(f"⚙️  {args.threads} 个线程，{render_workers} 个渲染进程")
+    if multi_process:
+        print("⚠️  多个工作进程之间不共享结果、布局和异步任务，/result、/jobs、/recolor 可能返回404，"
+              "需要负载均衡按客户端保持会话，或只使用直接返回图片的 /generate")
+    
+    # 在启动服务器之前预加载，gunicorn 的工作进程 fork 后直接共享
+    print("🔥 正在预加载字体、地图模板和形状掩码...")
+    preload_shared_state()
+    print_startup_report()
+    
+    try:
+        if server == 'gunicorn':
+            # 渲染进程池在各工作进程初始化完成后启动（post_worker_init），不在主进程中启动
+            run_gunicorn(args.host, args.port, args.workers, args.threads, args.timeout)
+        else:
+            # waitress 收到 SIGTERM 时默认直接退出，改为抛出 SystemExit，使下面的 finally 关闭渲染进程池
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            # 在 waitress 创建线程之前 fork 渲染进程
+            if render_pool is not None:
+                gc.collect()
+                gc.freeze()
+                render_pool.start()
+            run_waitress(args.host, args.port, args.threads)
+    finally:
+        if render_pool is not None:
+            render_pool.shutdown()
+    return 0
 
 def main():
     """主函数"""
@@ -797,30 +3707,51 @@ def main():
     print("=" * 50)
     
     if len(sys.argv) > 1:
-        if sys.argv[1] == '--install':
+        if sys.argv[1] == 'render':
+            sys.exit(run_cli_render(sys.argv[2:]))
+        elif sys.argv[1] == 'serve':
+            sys.exit(run_serve(sys.argv[2:]))
+        elif sys.argv[1] == '--startup-report':
+            measure_startup()
+            return
+        elif sys.argv[1] == '--install':
             install_requirements()
             return
         elif sys.argv[1] == '--help':
             print("使用说明:")
-            print("  python wordcloud_app.py           - 直接启动应用")
-            print("  python wordcloud_app.py --install - 安装依赖")
-            print("  python wordcloud_app.py --help    - 显示帮助")
+            print("  python wordcloud_app.py             - 直接启动应用")
+            print("  python wordcloud_app.py --workers N - 使用N个渲染进程启动应用（0 表示不使用进程池）")
+            print("  python wordcloud_app.py --no-browser - 启动应用但不自动打开浏览器")
+            print("  python wordcloud_app.py serve [--server gunicorn|waitress] [--workers N] [--threads N]")
+            print("                                      - 使用生产级WSGI服务器运行（预加载，不打开浏览器）")
+            print("  python wordcloud_app.py render --input specs.jsonl --out dir/ [--workers N]")
+            print("                                      - 不启动服务器，批量生成词云图")
+            print("  python wordcloud_app.py --startup-report - 显示各依赖的导入耗时")
+            print("  python wordcloud_app.py --install   - 安装依赖")
+            print("  python wordcloud_app.py --help      - 显示帮助")
             return
     
-    # 检查依赖是否已安装
-    try:
-        import flask
-        import wordcloud
-        import numpy
-        import PIL
-    except ImportError:
+    # 检查依赖是否已安装（只查找模块，不实际导入）
+    if not all(importlib.util.find_spec(name) for name in ('flask', 'wordcloud', 'numpy', 'PIL')):
         print("⚠️  检测到缺少依赖，正在自动安装...")
         if not install_requirements():
             return
         print()
     
+    # 配置渲染进程池
+    workers = None
+    if '--workers' in sys.argv:
+        try:
+            workers = int(sys.argv[sys.argv.index('--workers') + 1])
+        except (IndexError, ValueError):
+            print("❌ --workers 需要一个整数参数")
+            return
+    configure_render_pool(workers)
+    
     # 启动应用
-    run_app()
+    run_app(open_browser='--no-browser' not in sys.argv)
+
+STARTUP_TIMINGS['module'] = time.perf_counter() - _MODULE_LOAD_START
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()